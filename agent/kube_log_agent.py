@@ -1,76 +1,489 @@
-from flask import Flask, jsonify, request
-import subprocess
+import asyncio
+import json
+import os
 import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
 
-app = Flask(__name__)
+from aiohttp import web
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# How many parsed lines are kept in memory per pod
+BUFFER_LINES = int(os.environ.get('AGENT_BUFFER_LINES', 2000))
+
+# How many lines are loaded when the stream is started for the first time
+INITIAL_TAIL = int(os.environ.get('AGENT_INITIAL_TAIL', 200))
+
+# Default number of lines returned when the caller gives no cursor
+DEFAULT_TAIL = 200
+
+# What is followed when the request doesn't say (the bot asks for /progress without parameters)
+DEFAULT_POD = os.environ.get('AGENT_POD', 'midgard-0')
+DEFAULT_NAMESPACE = os.environ.get('AGENT_NAMESPACE', '')
+DEFAULT_CONTAINER = os.environ.get('AGENT_CONTAINER', '')
+
+# Which pods may be followed: "namespace/pod" or "pod" (in AGENT_NAMESPACE), "namespace/*" for all pods of it,
+# separated by commas. Only AGENT_POD by default; anything else is refused with 403.
+ALLOWED_PODS = os.environ.get('AGENT_ALLOWED_PODS', '')
+
+# At most this many "kubectl logs -f" run at the same time; the others wait for a free slot
+MAX_STREAMS = int(os.environ.get('AGENT_MAX_STREAMS', 8))
+
+# A stream nobody has read for this long is stopped, freeing its slot
+IDLE_TIMEOUT = float(os.environ.get('AGENT_IDLE_TIMEOUT', 600))
+
+# How long a request waits for a new stream to load its first lines
+START_TIMEOUT = float(os.environ.get('AGENT_START_TIMEOUT', 10))
+
+# Log lines per written chunk of a streamed response
+CHUNK_LINES = 200
+
+# Kubernetes names: pods are DNS subdomains, namespaces and containers are DNS labels
+POD_RE = re.compile(r'^[a-z0-9]([-a-z0-9.]{0,251}[a-z0-9])?$')
+LABEL_RE = re.compile(r'^[a-z0-9]([-a-z0-9]{0,61}[a-z0-9])?$')
+
+
+# ANSI escape sequences pattern
+ANSI_ESCAPE_RE = re.compile(r'''
+    \x1B  # ESC
+    (?:   # 7-bit C1 Fe (except CSI)
+        [@-Z\\-_]
+    |     # or [ for CSI, followed by control codes
+        \[
+        [0-?]*  # Parameter bytes
+        [ -/]*  # Intermediate bytes
+        [@-~]   # Final byte
+    )
+''', re.VERBOSE)
+
+# Adjust the regex based on your actual log format.
+LOG_LINE_RE = re.compile(r'^(?P<level>\w+)\s+(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s+(?P<message>.*)$')
+
+# Metrics extracted from every line as it arrives: name -> regex with one numeric group.
+# Extra ones can be given as AGENT_METRICS="name=regex;name2=regex2".
+DEFAULT_METRICS = {
+    'progress': r'progress=(\d+(?:\.\d+)?)%',
+}
+
+
+def load_allowed_pods(spec=None):
+    """
+    {(namespace, pod)} from the AGENT_ALLOWED_PODS format; pod may be '*'.
+    """
+    allowed = set()
+    for item in (spec or '').replace(',', ' ').split():
+        namespace, _, pod = item.rpartition('/')
+        allowed.add((namespace or DEFAULT_NAMESPACE, pod))
+    return allowed or {(DEFAULT_NAMESPACE, DEFAULT_POD)}
+
+
+ALLOWED = load_allowed_pods(ALLOWED_PODS)
+
+
+def load_metric_patterns(spec=None):
+    patterns = dict(DEFAULT_METRICS)
+    for item in (spec or '').split(';'):
+        name, sep, pattern = item.partition('=')
+        if sep and name.strip() and pattern:
+            patterns[name.strip()] = pattern
+    return {name: re.compile(pattern) for name, pattern in patterns.items()}
+
+
+METRIC_PATTERNS = load_metric_patterns(os.environ.get('AGENT_METRICS'))
+
+
+# JSON: orjson when it is installed, the standard library otherwise; dumps returns compact UTF-8 bytes
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode('utf-8')
 
 
 def remove_ansi_escape_sequences(text):
     """
     Removes ANSI escape sequences from the given text using regex.
     """
-    # ANSI escape sequences pattern^
-    ansi_escape = re.compile(r'''
-        \x1B  # ESC
-        (?:   # 7-bit C1 Fe (except CSI)
-            [@-Z\\-_]
-        |     # or [ for CSI, followed by control codes
-            \[
-            [0-?]*  # Parameter bytes
-            [ -/]*  # Intermediate bytes
-            [@-~]   # Final byte
-        )
-    ''', re.VERBOSE)
-    return ansi_escape.sub('', text)
+    return ANSI_ESCAPE_RE.sub('', text)
 
 
 def parse_log_line(line):
     """
     Parses a log line into structured components.
-    Adjust the regex based on your actual log format.
     """
-    log_pattern = re.compile(r'^(?P<level>\w+)\s+(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s+(?P<message>.*)$')
-    match = log_pattern.match(line)
+    match = LOG_LINE_RE.match(line)
     if match:
         return match.groupdict()
     else:
         return {"raw": line}
 
 
-@app.route('/logs', methods=['GET'])
-def get_logs():
+def line_time(parsed):
+    """
+    Unix time of the line's own timestamp (taken as UTC), None if it has none.
+    """
     try:
-        # pod_name = request.args.get('pod', 'midgard-0')  # Default pod name
-        # tail_lines = request.args.get('tail', '200')  # Default tail value
+        return datetime.strptime(parsed['timestamp'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, ValueError):
+        return None
+
+
+def extract_metrics(text):
+    """
+    Returns {name: value} for every metric pattern found in the line.
+    """
+    found = {}
+    for name, pattern in METRIC_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            try:
+                found[name] = float(match.group(1))
+            except (IndexError, ValueError):
+                pass
+    return found
+
+
+class BadRequest(Exception):
+    pass
 
-        pod_name, tail_lines = 'midgard-0', '200'  # Hardcoded values
 
-        # Validate 'tail_lines' to ensure it's a positive integer
-        if not tail_lines.isdigit() or int(tail_lines) <= 0:
-            return jsonify({'error': 'Invalid tail value. It must be a positive integer.'}), 400
+class Forbidden(Exception):
+    pass
 
-        # Construct the kubectl command
-        command = ['kubectl', 'logs', pod_name, f'--tail={tail_lines}']
 
-        # Execute the command
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
+class TooManyStreams(Exception):
+    pass
 
-        # Remove ANSI escape sequences
-        clean_logs = remove_ansi_escape_sequences(result.stdout)
 
-        # Split logs into individual lines and filter out empty lines
-        raw_log_lines = [line for line in clean_logs.split('\n') if line.strip()]
+class Target:
+    """
+    Validated pod, container and namespace of a request; only the allowed pods pass.
+    """
+
+    def __init__(self, query):
+        self.pod = query.get('pod') or DEFAULT_POD
+        self.container = query.get('container') or DEFAULT_CONTAINER
+        self.namespace = query.get('namespace') or DEFAULT_NAMESPACE
+        if not POD_RE.match(self.pod):
+            raise BadRequest(f'Invalid pod name: {self.pod!r}')
+        for what, value in (('container', self.container), ('namespace', self.namespace)):
+            if value and not LABEL_RE.match(value):
+                raise BadRequest(f'Invalid {what} name: {value!r}')
+        if not ALLOWED & {(self.namespace, self.pod), (self.namespace, '*')}:
+            raise Forbidden(f'{self} is not allowed')
+
+    @property
+    def key(self):
+        return self.namespace, self.pod, self.container
+
+    def __str__(self):
+        name = f'{self.namespace}/{self.pod}' if self.namespace else self.pod
+        return f'{name}:{self.container}' if self.container else name
+
+
+def int_param(query, name, default=None, minimum=0, maximum=None):
+    value = query.get(name)
+    if value is None:
+        return default
+    if not value.isdigit() or int(value) < minimum:
+        raise BadRequest(f'Invalid {name} value. It must be an integer not less than {minimum}.')
+    return min(int(value), maximum) if maximum else int(value)
+
+
+class LogStream:
+    """
+    One long-lived "kubectl logs -f" process per pod/container feeding a ring buffer of parsed lines.
+    Every line gets a sequence number, so callers can ask only for the lines after their cursor.
+    Requests for the same pod share the stream: kubectl is started once, however many of them arrive at once.
+    """
+
+    def __init__(self, target: Target, slots: asyncio.Semaphore, capacity=BUFFER_LINES, initial_tail=INITIAL_TAIL):
+        self.target = target
+        self.slots = slots
+        self.initial_tail = initial_tail
+        self.lines = deque(maxlen=capacity)  # (seq, parsed line)
+        self.metrics = {}  # name -> {'value', 'ts', 'seq'} of the latest line that had it; ts of the line itself
+        self.seq = 0
+        self.error = None
+        self.last_line_ts = None
+        self.last_read = time.monotonic()
+        self.ready = asyncio.Event()  # set when kubectl has given the first lines or failed
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._follow())
+        return self
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    @property
+    def idle(self):
+        return time.monotonic() - self.last_read > IDLE_TIMEOUT
+
+    async def wait_ready(self, timeout=START_TIMEOUT) -> bool:
+        self.last_read = time.monotonic()
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.ready.is_set()
+
+    def _command(self):
+        command = ['kubectl', 'logs', '-f', self.target.pod]
+        if self.target.namespace:
+            command += ['-n', self.target.namespace]
+        if self.target.container:
+            command += ['-c', self.target.container]
+        if self.last_line_ts is None:
+            command.append(f'--tail={self.initial_tail}')
+        else:
+            # reconnecting: only what we could have missed (may repeat a few lines)
+            command.append(f'--since={int(time.time() - self.last_line_ts) + 1}s')
+        return command
+
+    async def _follow(self):
+        backoff = 1
+        while True:
+            started = time.monotonic()
+            async with self.slots:
+                try:
+                    await self._run_kubectl()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.error = str(e)
+            self.ready.set()
+
+            if time.monotonic() - started > 60:
+                backoff = 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    @staticmethod
+    async def _read_stderr(stream, tail: deque):
+        # read all the time: kubectl blocks once the pipe is full
+        async for raw_line in stream:
+            tail.append(raw_line.decode('utf-8', errors='replace').strip())
+
+    async def _run_kubectl(self):
+        proc = await asyncio.create_subprocess_exec(
+            *self._command(), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stderr_tail = deque(maxlen=5)
+        stderr_reader = asyncio.create_task(self._read_stderr(proc.stderr, stderr_tail))
+        try:
+            loaded_by = time.monotonic() + 1.0
+            while True:
+                if self.ready.is_set():
+                    raw_line = await proc.stdout.readline()
+                else:
+                    # kubectl writes the tail at once: the first pause means it's all loaded
+                    try:
+                        raw_line = await asyncio.wait_for(proc.stdout.readline(),
+                                                          min(0.2, max(0.0, loaded_by - time.monotonic())))
+                    except asyncio.TimeoutError:
+                        self.ready.set()
+                        continue
+                if not raw_line:
+                    break
+                self._append(raw_line.decode('utf-8', errors='replace'))
+            await proc.wait()
+            await stderr_reader
+            stderr = ' '.join(line for line in stderr_tail if line)
+            self.error = f'kubectl exited with code {proc.returncode}: {stderr}'
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            stderr_reader.cancel()
+
+    def _append(self, raw_line):
+        line = remove_ansi_escape_sequences(raw_line).rstrip('\n')
+        if not line.strip():
+            return
+        parsed = parse_log_line(line)
+        found = extract_metrics(parsed.get('message', line))
+        self.seq += 1
+        self.lines.append((self.seq, parsed))
+        self.last_line_ts = time.time()
+        self.error = None
+        ts = line_time(parsed) or self.last_line_ts
+        for name, value in found.items():
+            previous = self.metrics.get(name)
+            if previous and (ts < previous['ts'] or (ts == previous['ts'] and value == previous['value'])):
+                continue  # a line given again by kubectl after a reconnect
+            self.metrics[name] = {'value': value, 'ts': ts, 'seq': self.seq}
+
+    def read_metrics(self):
+        self.last_read = time.monotonic()
+        return {name: dict(m) for name, m in self.metrics.items()}, self.seq
+
+    def read(self, since=None, limit=DEFAULT_TAIL):
+        """
+        Returns (lines after the cursor, new cursor, truncated).
+        truncated is True if some lines after the cursor are no longer in the buffer
+        or the cursor is from a previous run of the agent.
+        """
+        self.last_read = time.monotonic()
+        cursor = self.seq
+        first_seq = self.lines[0][0] if self.lines else cursor + 1
+        if since is None:
+            start, truncated = max(len(self.lines) - limit, 0), False
+        elif since > cursor:
+            start, truncated = 0, True
+        else:
+            start = max(since + 1 - first_seq, 0)
+            truncated = since + 1 < first_seq
+            if len(self.lines) - start > limit:
+                start, truncated = len(self.lines) - limit, True
+        lines = [parsed for _, parsed in islice(self.lines, start, None)]
+        return lines, cursor, truncated
+
+
+class Agent:
+    """
+    The followed streams by pod/container/namespace. Requests for the same one at the same time
+    wait for the same kubectl and read the same buffer.
+    """
+
+    def __init__(self, max_streams=MAX_STREAMS):
+        self.slots = asyncio.Semaphore(max_streams)
+        self.max_waiting = max_streams  # streams waiting for a slot on top of the running ones
+        self.max_streams = max_streams
+        self.streams = {}  # Target.key -> LogStream
+        self.reaper = None
+
+    async def get_stream(self, target: Target) -> LogStream:
+        stream = self.streams.get(target.key)
+        if stream is None:
+            if len(self.streams) >= self.max_streams + self.max_waiting:
+                raise TooManyStreams(f'Already following {len(self.streams)} pods, try later')
+            stream = self.streams[target.key] = LogStream(target, self.slots).start()
+        if not await stream.wait_ready():
+            # kubectl gives the first lines within a second once started
+            raise TooManyStreams(f'{target} is waiting for one of {self.max_streams} kubectl slots, try later')
+        return stream
+
+    async def reap_idle_streams(self):
+        while True:
+            await asyncio.sleep(min(IDLE_TIMEOUT, 60))
+            for key, stream in list(self.streams.items()):
+                if stream.idle:
+                    del self.streams[key]
+                    await stream.stop()
+
+    async def on_startup(self, app):
+        self.reaper = asyncio.create_task(self.reap_idle_streams())
+
+    async def on_cleanup(self, _app):
+        if self.reaper:
+            self.reaper.cancel()
+        for stream in self.streams.values():
+            await stream.stop()
+
+
+AGENT = web.AppKey('agent', Agent)
+
+
+def json_response(payload, status=200):
+    return web.Response(body=dumps(payload), status=status, content_type='application/json')
+
+
+def error_response(message, status, **extra):
+    return json_response({'error': message, **extra}, status)
+
+
+async def stream_ndjson(request, header: dict, items):
+    """
+    Writes the header and then every item as a line of JSON, chunk by chunk (gzip-compressed
+    if the client accepts it): the whole document is never built in memory.
+    """
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    response.enable_compression()
+    await response.prepare(request)
+
+    await response.write(dumps(header) + b'\n')
+    for i in range(0, len(items), CHUNK_LINES):
+        await response.write(b''.join(dumps(item) + b'\n' for item in items[i:i + CHUNK_LINES]))
+    await response.write_eof()
+    return response
+
+
+async def get_logs(request: web.Request):
+    """
+    NDJSON: {"pod", "cursor", "truncated"} first, then the log lines after the cursor, one per line.
+    """
+    agent = request.app[AGENT]
+    try:
+        target = Target(request.query)
+        tail = int_param(request.query, 'tail', DEFAULT_TAIL, minimum=1, maximum=BUFFER_LINES)
+        since = int_param(request.query, 'since')
+    except BadRequest as e:
+        return error_response(str(e), 400)
+    except Forbidden as e:
+        return error_response(str(e), 403)
+
+    try:
+        stream = await agent.get_stream(target)
+    except TooManyStreams as e:
+        return error_response(str(e), 503)
+    lines, cursor, truncated = stream.read(since, tail)
+    if not lines and stream.error:
+        return error_response(f'Command failed: {stream.error}', 500, cursor=cursor)
+
+    return await stream_ndjson(request, {'pod': str(target), 'cursor': cursor, 'truncated': truncated}, lines)
+
+
+async def get_progress(request: web.Request):
+    """
+    Only the latest values of the metrics (sync progress and the configured ones), not the log lines.
+    """
+    agent = request.app[AGENT]
+    try:
+        target = Target(request.query)
+    except BadRequest as e:
+        return error_response(str(e), 400)
+    except Forbidden as e:
+        return error_response(str(e), 403)
+
+    try:
+        stream = await agent.get_stream(target)
+    except TooManyStreams as e:
+        return error_response(str(e), 503)
+    metrics, cursor = stream.read_metrics()
+    progress = metrics.get('progress')
+    return json_response({
+        'progress': progress['value'] if progress else None,
+        'metrics': metrics,
+        'cursor': cursor,
+        'error': stream.error,
+    })
 
-        # Parse each log line into structured data
-        parsed_logs = [parse_log_line(line) for line in raw_log_lines]
 
-        # Return the logs as a list of objects
-        return jsonify({'logs': parsed_logs})
-    except subprocess.CalledProcessError as e:
-        return jsonify({'error': f'Command failed: {e.stderr.strip()}'}), 500
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+def make_app():
+    app = web.Application()
+    agent = app[AGENT] = Agent()
+    app.on_startup.append(agent.on_startup)
+    app.on_cleanup.append(agent.on_cleanup)
+    app.router.add_get('/logs', get_logs)
+    app.router.add_get('/progress', get_progress)
+    return app
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    web.run_app(make_app(), host=os.environ.get('AGENT_HOST', '0.0.0.0'), port=int(os.environ.get('AGENT_PORT', 5000)))
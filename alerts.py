@@ -1,46 +1,306 @@
-from urllib import parse
+import asyncio
+import itertools
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
 
 from logs import WithLogger
-from utils import to_json_bool
+from routing import Router, INFO
+from suppressor import AlertSuppressor
+from utils import MINUTE, HOUR
+
+TELEGRAM_MAX_LENGTH = 4096
+TELEGRAM_API_URL = 'https://api.telegram.org'
+
+
+def split_message(text: str, limit: int = TELEGRAM_MAX_LENGTH) -> List[str]:
+    """
+    Splits text into parts no longer than limit, preferably at line breaks.
+    """
+    parts, current = [], ''
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(line[:limit])
+            line = line[limit:]
+        candidate = f'{current}\n{line}' if current else line
+        if len(candidate) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = candidate
+    if current.strip():
+        parts.append(current)
+    return [p for p in parts if p.strip()]
+
+
+def pack_messages(texts: List[str], limit: int = TELEGRAM_MAX_LENGTH, separator='\n\n') -> List[str]:
+    """
+    Joins whole messages into parts no longer than limit, so that no part ends inside an HTML tag of a message.
+    Only a message longer than the limit by itself is split (see split_message).
+    """
+    parts, current = [], ''
+    for text in texts:
+        if len(text) > limit:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.extend(split_message(text, limit))
+            continue
+        candidate = f'{current}{separator}{text}' if current else text
+        if len(candidate) > limit:
+            parts.append(current)
+            current = text
+        else:
+            current = candidate
+    if current.strip():
+        parts.append(current)
+    return [p for p in parts if p.strip()]
+
+
+class TelegramError(Exception):
+    def __init__(self, status, description='', retry_after=None):
+        super().__init__(f'Telegram error {status}: "{description}"')
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+
+class ChatQueue(WithLogger):
+    """
+    Alerts for one chat: its own bounded queue and worker, so that a slow or blocked chat doesn't delay the others.
+    Alerts queued within batch_window seconds are merged into one message.
+    """
+
+    def __init__(self, sender: 'AlertSender', chat_id, queue_size=1000):
+        super().__init__()
+        self.sender = sender
+        self.chat_id = chat_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._worker = None
+        self._next_send_ts = 0.0  # monotonic time
+
+    @property
+    def min_interval(self):
+        # Telegram allows ~1 message/sec to a private chat and 20 messages/min to a group (negative id)
+        return 3.0 if int(self.chat_id) < 0 else 1.0
+
+    def put(self, text):
+        if self.queue.full():
+            # the oldest alert is the least relevant one
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.sender.dropped += 1
+            self.logger.warning(f"[{self.chat_id}] Alert queue is full, dropped the oldest alert "
+                                f"(total dropped: {self.sender.dropped})")
+        self.queue.put_nowait(text)
+        self.sender.queued += 1
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._work())
+
+    def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    def drain(self):
+        texts = []
+        while not self.queue.empty():
+            texts.append(self.queue.get_nowait())
+            self.queue.task_done()
+        return texts
+
+    async def _collect_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.sender.batch_window
+        while len(batch) < self.sender.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _work(self):
+        while True:
+            batch = await self._collect_batch()
+            try:
+                for part in pack_messages(batch):
+                    await self._deliver(part)
+            except Exception as e:
+                self.logger.exception(f"[{self.chat_id}] Error sending alert: {e!r}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _deliver(self, text):
+        sender = self.sender
+        parse_mode = 'HTML'
+        for attempt in range(1, sender.max_attempts + 1):
+            delay = self._next_send_ts - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_send_ts = time.monotonic() + self.min_interval
+
+            try:
+                await sender.telegram_send_message_basic(self.chat_id, text, parse_mode=parse_mode)
+                sender.sent += 1
+                return True
+            except TelegramError as e:
+                if e.status == 429:
+                    retry_after = float(e.retry_after or min(2 ** attempt, 60))
+                    self.logger.warning(f"[{self.chat_id}] Telegram rate limit, retry after {retry_after} sec")
+                    self._next_send_ts = time.monotonic() + retry_after
+                elif e.status == 400 and parse_mode:
+                    # most likely broken markup: the text still gets through as it is
+                    self.logger.warning(f"[{self.chat_id}] Alert rejected ({e.description}), sending it as plain text")
+                    parse_mode = None
+                elif 400 <= e.status < 500:
+                    # won't get better by retrying
+                    sender.failed += 1
+                    self.logger.error(f"[{self.chat_id}] Alert rejected: {e}")
+                    return False
+                else:
+                    self.logger.warning(f"[{self.chat_id}] Attempt #{attempt} failed: {e}")
+                    self._next_send_ts = time.monotonic() + min(2 ** attempt, 60)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"[{self.chat_id}] Attempt #{attempt} failed: {e!r}")
+                self._next_send_ts = time.monotonic() + min(2 ** attempt, 60)
+
+        sender.failed += 1
+        self.logger.error(f"[{self.chat_id}] Giving up on alert after {sender.max_attempts} attempts")
+        return False
 
 
 class AlertSender(WithLogger):
-    def __init__(self, session, bot_token, receiver_id):
+    """
+    send() only routes the text to the queues of its chats and returns at once; every chat has its own worker.
+    Without routes everything goes to receiver_id. Per-chat rate limits of Telegram are respected
+    and 429 "retry_after" is honored.
+    """
+
+    def __init__(self, session, bot_token, receiver_id,
+                 queue_size=1000, batch_window=2.0, max_batch=20, max_attempts=5,
+                 api_url=TELEGRAM_API_URL, repeat_cooldown=MINUTE, max_repeat_cooldown=6 * HOUR, dry_run=False,
+                 router: Optional[Router] = None):
         super().__init__()
+        self.dry_run = dry_run  # alerts are only queued, see drain()
+        self.api_url = api_url.rstrip('/')
         self.session = session
         self.bot_token = bot_token
         self.receiver_id = receiver_id
+        self.router = router or Router([], [receiver_id])
+        self.suppressor = AlertSuppressor(self, repeat_cooldown, max_repeat_cooldown)
+
+        self.queue_size = queue_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.chats: Dict[int, ChatQueue] = {}
+        self._started = False
+
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.muted = 0
+
+    @property
+    def queue_depth(self):
+        return sum(chat.queue.qsize() for chat in self.chats.values())
+
+    def set_router(self, router: Router):
+        """
+        Alerts already queued for a chat are still delivered there.
+        """
+        self.router = router
+        self.logger.info(f"Alert routes: {router.routes or 'none'}; default chats: {router.default_chats}")
 
     async def telegram_send_message_basic(self, user_id, message_text: str,
                                           disable_web_page_preview=True,
-                                          disable_notification=False):
-
+                                          disable_notification=False, parse_mode='HTML'):
         message_text = message_text.strip()
-        message_text = message_text[:1024]
-
         if not message_text:
             return
 
-        message_text = parse.quote_plus(message_text)
-        url = (
-            f"https://api.telegram.org/"
-            f"bot{self.bot_token}/sendMessage?"
-            f"chat_id={user_id}&"
-            f"text={message_text}&"
-            f"parse_mode=HTML&"
-            f"disable_web_page_preview={to_json_bool(disable_web_page_preview)}&"
-            f"disable_notification={to_json_bool(disable_notification)}"
-        )
-
-        async with self.session.get(url) as resp:
+        url = f"{self.api_url}/bot{self.bot_token}/sendMessage"
+        payload = {
+            'chat_id': user_id,
+            'text': message_text,
+            'disable_web_page_preview': disable_web_page_preview,
+            'disable_notification': disable_notification,
+        }
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+
+        async with self.session.post(url, json=payload) as resp:
             if resp.status != 200:
-                err = await resp.read()
-                raise Exception(f'Telegram error: "{err}"')
-            return resp.status == 200
+                try:
+                    err = await resp.json(content_type=None)
+                except ValueError:
+                    err = {'description': await resp.text()}
+                raise TelegramError(
+                    resp.status,
+                    err.get('description', ''),
+                    (err.get('parameters') or {}).get('retry_after'),
+                )
+            return True
 
-    async def send(self, text):
+    async def send(self, text, job=None, node=None, severity=INFO):
+        text = text.strip() if text else ''
+        if not text:
+            return
+
+        chat_ids = self.router.lookup(job, severity, node)
+        if not chat_ids:
+            self.muted += 1
+            self.logger.info(f"Muted alert: {text!r}")
+            return
+
+        self.logger.info(f"Queueing alert: {text!r}")
+        if not self._started:
+            self.start()
+        for chat_id in chat_ids:
+            self.chat_queue(chat_id).put(text)
+
+    def chat_queue(self, chat_id) -> ChatQueue:
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = ChatQueue(self, chat_id, self.queue_size)
+            if self._started and not self.dry_run:
+                chat.start()
+        return chat
+
+    def start(self):
+        self._started = True
+        if self.dry_run:
+            return
+        for chat in self.chats.values():
+            chat.start()
+
+    async def stop(self, timeout=5.0):
+        chats = list(self.chats.values())
         try:
-            self.logger.info(f"Sending alert: {text!r}")
-            await self.telegram_send_message_basic(self.receiver_id, text)
-        except Exception as e:
-            self.logger.exception(f"Error sending alert: {e!r}")
+            await asyncio.wait_for(asyncio.gather(*(chat.queue.join() for chat in chats)), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{self.queue_depth} alerts were not delivered before shutdown")
+        for chat in chats:
+            chat.stop()
+        self._started = False
+
+    def drain(self):
+        """
+        Takes all queued alerts out without sending them; an alert routed to several chats is returned once.
+        """
+        texts = itertools.chain(*(chat.drain() for chat in self.chats.values()))
+        return list(dict.fromkeys(texts))
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark of JSON decoding (bot side) and encoding (agent side) on realistic payloads:
+the old path against the stdlib and orjson backends of codec.py.
+
+    python bench/bench_codec.py
+"""
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import codec  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHAINS = ['AVAX', 'BCH', 'BSC', 'BTC', 'DOGE', 'ETH', 'GAIA', 'LTC', 'BASE']
+
+
+def payloads():
+    lastblock = [
+        {'chain': chain, 'last_observed_in': 18_000_000 + i, 'last_signed_out': 18_000_000 + i,
+         'thorchain': 19_000_000}
+        for i, chain in enumerate(CHAINS)
+    ]
+    version = {'current': '3.0.0', 'next': '3.1.0', 'next_since_height': 19_000_100, 'querier': '3.0.0'}
+    health = {
+        'database': True, 'inSync': True, 'scannerHeight': 19_000_001,
+        'lastThorNode': {'height': 19_000_000, 'timestamp': 1_700_000_000},
+        'lastFetched': {'height': 19_000_000, 'timestamp': 1_700_000_000},
+        'lastCommitted': {'height': 19_000_000, 'timestamp': 1_700_000_000},
+        'lastAggregated': {'height': 19_000_000, 'timestamp': 1_700_000_000},
+        'genesisInfo': {'height': 1, 'hash': '9B0B1D' * 10},
+    }
+    logs = {
+        'logs': [
+            {'level': 'INFO', 'timestamp': '2024-05-01 12:00:00',
+             'message': f'block {18_000_000 + i} processed, progress={50 + i / 1000:.3f}% '
+                        f'took 12.5ms events=42 ⚡'}
+            for i in range(200)
+        ],
+        'cursor': 123456,
+        'truncated': False,
+    }
+    progress = {
+        'progress': 55.5,
+        'metrics': {'progress': {'value': 55.5, 'ts': 1_700_000_000.5, 'seq': 123456}},
+        'cursor': 123456,
+        'error': None,
+    }
+    return {
+        'lastblock': lastblock,
+        'version': version,
+        'health': health,
+        'agent_logs': logs,
+        'agent_progress': progress,
+    }
+
+
+def per_second(fn):
+    number, _ = timeit.Timer(fn).autorange()
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return number / best
+
+
+def flask_dumps(obj):
+    # what flask.jsonify does outside of debug mode
+    return json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def main():
+    decoders = {
+        'old (text + json)': lambda b: json.loads(b.decode('utf-8')),
+        'stdlib (bytes)': json.loads,
+    }
+    encoders = {
+        'old (flask jsonify)': flask_dumps,
+        'stdlib (compact)': lambda o: json.dumps(o, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+    }
+    if orjson is not None:
+        decoders['orjson'] = orjson.loads
+        encoders['orjson'] = orjson.dumps
+    print(f'codec.py backend: {codec.BACKEND}\n')
+
+    for title, variants, prepare in (
+            ('decode (bot)', decoders, lambda obj: codec.dumps(obj)),
+            ('encode (agent)', encoders, lambda obj: obj),
+    ):
+        print(f"{title:<16}{'size':>8}" + ''.join(f'{name:>22}' for name in variants) + f"{'speedup':>10}")
+        for name, obj in payloads().items():
+            data = prepare(obj)
+            size = len(codec.dumps(obj))
+            rates = [per_second(lambda fn=fn: fn(data)) for fn in variants.values()]
+            cells = ''.join(f'{rate:>16,.0f} op/s' for rate in rates)
+            print(f'{name:<16}{size:>8}{cells}{rates[-1] / rates[0]:>9.1f}x')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Local stand-ins for THORNode, Midgard, the kube log agent and the Telegram Bot API.
+The bot tells nodes apart by host:port, so every fake node gets its own port on 127.0.0.1;
+all of them are served by one aiohttp application that looks the node up by the local port.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+
+class Behaviour:
+    """
+    Response latency (uniform base ± jitter) and the share of requests answered with HTTP 500.
+    """
+
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    async def delay(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def fails(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class FakeChain:
+    """
+    The "true" chain: one block every block_time seconds since the start.
+    """
+
+    def __init__(self, block_time=6.0, start_height=10_000_000, version='3.0.0'):
+        self.block_time = block_time
+        self.start_height = start_height
+        self.version = version
+        self.started = time.monotonic()
+
+    def height(self, lag=0, drift=0.0):
+        """
+        lag: blocks behind from the start; drift: how many more blocks it loses per minute.
+        """
+        elapsed = time.monotonic() - self.started
+        return int(self.start_height + elapsed / self.block_time - lag - drift * elapsed / 60)
+
+
+class FakeNode:
+    def __init__(self, name, port, chain: FakeChain, behaviour: Behaviour,
+                 lag=0, drift=0.0, version=None, in_sync=True, database=True):
+        self.name = name
+        self.port = port
+        self.chain = chain
+        self.behaviour = behaviour
+        self.lag = lag
+        self.drift = drift
+        self.version = version
+        self.in_sync = in_sync
+        self.database = database
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    @property
+    def spec(self):
+        return f'{self.name}={self.url}'
+
+    def height(self):
+        return self.chain.height(self.lag, self.drift)
+
+    def lastblock(self):
+        return [{'chain': 'BTC', 'thorchain': self.height()}]
+
+    def thor_version(self):
+        version = self.version or self.chain.version
+        return {'current': version, 'next': version, 'querier': version}
+
+    def health(self):
+        return {
+            'database': self.database,
+            'inSync': self.in_sync,
+            'scannerHeight': self.height() + 1,
+            'lastThorNode': {'height': self.height()},
+            'lastFetched': {'height': self.height()},
+            'lastCommitted': {'height': self.height()},
+            'lastAggregated': {'height': self.height()},
+        }
+
+
+class FakeAgent:
+    """
+    The kube log agent: Midgard log lines with a sync progress growing at `rate` %/h.
+    """
+
+    def __init__(self, port, behaviour: Behaviour, progress=50.0, rate=60.0, capacity=2000):
+        self.port = port
+        self.behaviour = behaviour
+        self.progress = progress
+        self.rate = rate
+        self.lines = deque(maxlen=capacity)
+        self.seq = 0
+        self.progress_seq = None
+        self.requests = 0
+        self._last_update = time.monotonic()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def update(self):
+        now = time.monotonic()
+        if now - self._last_update < 1.0:
+            return
+        self.progress = min(100.0, self.progress + self.rate * (now - self._last_update) / 3600)
+        self._last_update = now
+        self.seq += 1
+        self.progress_seq = self.seq
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        message = f'sync progress={self.progress:.2f}%'
+        self.lines.append((self.seq, {'level': 'INFO', 'timestamp': timestamp, 'message': message}))
+
+    def logs(self, since=None, tail=200):
+        lines = [line for seq, line in self.lines if since is None or seq > since]
+        return {'logs': lines[-tail:], 'cursor': self.seq, 'truncated': len(lines) > tail}
+
+    def progress_info(self):
+        metrics = {}
+        if self.progress_seq is not None:
+            metrics['progress'] = {'value': round(self.progress, 2), 'ts': time.time(), 'seq': self.progress_seq}
+        return {
+            'progress': metrics['progress']['value'] if metrics else None,
+            'metrics': metrics,
+            'cursor': self.seq,
+            'error': None,
+        }
+
+
+class FakeTelegram:
+    """
+    sendMessage that records (monotonic arrival time, chat id, text).
+    """
+
+    def __init__(self, port, behaviour: Behaviour):
+        self.port = port
+        self.behaviour = behaviour
+        self.messages = []
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+
+class FakeCluster:
+    def __init__(self, nodes: List[FakeNode], agent: Optional[FakeAgent] = None,
+                 telegram: Optional[FakeTelegram] = None):
+        self.nodes: Dict[int, FakeNode] = {node.port: node for node in nodes}
+        self.agent = agent
+        self.telegram = telegram
+        self.runner: Optional[web.AppRunner] = None
+
+        app = self.app = web.Application()
+        app.router.add_get('/thorchain/lastblock', self.node_handler(FakeNode.lastblock))
+        app.router.add_get('/thorchain/version', self.node_handler(FakeNode.thor_version))
+        app.router.add_get('/v2/health', self.node_handler(FakeNode.health))
+        app.router.add_get('/logs', self.handle_logs)
+        app.router.add_get('/progress', self.handle_progress)
+        app.router.add_post('/bot{token}/sendMessage', self.handle_send_message)
+
+    @property
+    def ports(self):
+        ports = list(self.nodes)
+        for extra in (self.agent, self.telegram):
+            if extra is not None:
+                ports.append(extra.port)
+        return ports
+
+    @property
+    def requests(self):
+        return sum(node.requests for node in self.nodes.values()) + sum(
+            extra.requests for extra in (self.agent, self.telegram) if extra is not None)
+
+    @staticmethod
+    def local_port(request: web.Request):
+        return request.transport.get_extra_info('sockname')[1]
+
+    def node_handler(self, method):
+        async def handler(request: web.Request):
+            node = self.nodes.get(self.local_port(request))
+            if node is None:
+                raise web.HTTPNotFound()
+            node.requests += 1
+            await node.behaviour.delay()
+            if node.behaviour.fails():
+                raise web.HTTPInternalServerError()
+            return web.json_response(method(node))
+
+        return handler
+
+    async def handle_logs(self, request: web.Request):
+        agent = self.agent
+        agent.requests += 1
+        await agent.behaviour.delay()
+        if agent.behaviour.fails():
+            raise web.HTTPInternalServerError()
+        agent.update()
+        since = request.query.get('since')
+        tail = int(request.query.get('tail', 200))
+        return web.json_response(agent.logs(int(since) if since is not None else None, tail))
+
+    async def handle_progress(self, _request: web.Request):
+        agent = self.agent
+        agent.requests += 1
+        await agent.behaviour.delay()
+        if agent.behaviour.fails():
+            raise web.HTTPInternalServerError()
+        agent.update()
+        return web.json_response(agent.progress_info())
+
+    async def handle_send_message(self, request: web.Request):
+        telegram = self.telegram
+        telegram.requests += 1
+        await telegram.behaviour.delay()
+        if telegram.behaviour.fails():
+            return web.json_response({'ok': False, 'error_code': 500, 'description': 'Internal Server Error'},
+                                     status=500)
+        data = await request.json()
+        telegram.messages.append((time.monotonic(), data.get('chat_id'), data.get('text', '')))
+        return web.json_response({'ok': True, 'result': {'message_id': len(telegram.messages)}})
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        for port in self.ports:
+            await web.TCPSite(self.runner, '127.0.0.1', port, backlog=1024).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,335 @@
+"""
+Load benchmark: runs the real jobs from main.py against local fake nodes (see fake_servers.py)
+and reports ticks/s, tick latency percentiles, alert delivery latency, CPU time and RSS.
+
+    python bench/run_bench.py --nodes 200 --duration 60 --period 2 --lagging 0.05
+    python bench/run_bench.py --nodes 200 --duration 60 --compare bench/results/baseline.json
+
+Results are saved as JSON (bench/results/ by default) with the parameters and the git revision,
+so two runs with the same parameters can be compared with --compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_servers import Behaviour, FakeAgent, FakeChain, FakeCluster, FakeNode, FakeTelegram  # noqa: E402
+from profiling import percentile  # noqa: E402
+
+# metrics where more is worse; --compare flags them when they grow beyond the tolerance
+LOWER_IS_BETTER = ('tick_p50', 'tick_p90', 'tick_p99', 'tick_max', 'alert_p50', 'alert_p90', 'alert_max',
+                   'cpu_per_tick_ms', 'cpu_share', 'rss_max_mb', 'overruns')
+HIGHER_IS_BETTER = ('ticks_per_sec',)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # peak only; ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'n': 0}
+    return {
+        'n': len(values),
+        'p50': percentile(values, 0.5),
+        'p90': percentile(values, 0.9),
+        'p99': percentile(values, 0.99),
+        'max': values[-1],
+    }
+
+
+def build_cluster(args):
+    chain = FakeChain(block_time=args.block_time)
+    port = iter(range(args.base_port, args.base_port + 65536))
+    behaviour = Behaviour(args.latency, args.jitter, args.error_rate)
+    reference_behaviour = Behaviour(args.ref_latency, args.jitter, args.error_rate)
+
+    lagging = round(args.nodes * args.lagging)
+    nodes = [
+        FakeNode(f'n{i}', next(port), chain, behaviour,
+                 lag=args.lag if i < lagging else 0,
+                 drift=args.drift if i < lagging else 0.0)
+        for i in range(args.nodes)
+    ]
+    refs = [FakeNode(f'ref{i}', next(port), chain, reference_behaviour) for i in range(args.refs)]
+    agent = FakeAgent(next(port), Behaviour(args.latency, args.jitter, 0.0), rate=args.sync_rate)
+    telegram = FakeTelegram(next(port), Behaviour(args.telegram_latency, 0.0, 0.0))
+    return FakeCluster(nodes + refs, agent, telegram), nodes, refs
+
+
+def configure_env(args, nodes, refs, cluster, state_file):
+    fleet = ','.join(node.spec for node in nodes)
+    references = ','.join(ref.spec for ref in refs)
+    os.environ.update({
+        'TG_ADMIN_USER': '1',
+        'TG_BOT_TOKEN': 'bench',
+        'TG_COMMANDS': '0',
+        'TELEGRAM_API_URL': cluster.telegram.url,
+        'THORNODE_TEST_URL': fleet,
+        'THORNODE_REF_URL': references,
+        'MIDGARD_HEALTH_TEST_URL': fleet,
+        'MIDGARD_HEALTH_REF_URL': references,
+        'MIDGARD_SYNC_STATUS_URL': cluster.agent.url,
+        'TICK_PERIOD': str(args.period),
+        'FLEET_CONCURRENCY': str(args.concurrency),
+        'STATE_FILE': state_file,
+        'METRICS_PORT': '0',
+    })
+    for item in args.env:
+        key, _, value = item.partition('=')
+        os.environ[key] = value
+
+
+def instrument(bot, tick_durations, queued_alerts):
+    """
+    Wraps the entry points the scheduler and the jobs call, to time them from the outside.
+    """
+    for job in bot.jobs:
+        def wrap(job=job, original=job.run_tick):
+            async def run_tick():
+                started = time.monotonic()
+                try:
+                    await original()
+                finally:
+                    tick_durations[job.name].append(time.monotonic() - started)
+
+            return run_tick
+
+        job.run_tick = wrap()
+
+    original_send = bot.alert.send
+
+    async def send(text, **route):
+        queued_alerts.append((time.monotonic(), text))
+        return await original_send(text, **route)
+
+    bot.alert.send = send
+
+
+def alert_latencies(queued_alerts, messages):
+    """
+    Alerts are batched, so a message may carry several of them: match every alert
+    with the first message that contains its text and arrived after it was queued.
+    """
+    latencies, lost = [], 0
+    for queued_at, text in queued_alerts:
+        for arrived, _chat, message in messages:
+            if arrived >= queued_at and text in message:
+                latencies.append(arrived - queued_at)
+                break
+        else:
+            lost += 1
+    return latencies, lost
+
+
+async def run(args):
+    cluster, nodes, refs = build_cluster(args)
+    await cluster.start()
+
+    state_dir = tempfile.TemporaryDirectory()
+    configure_env(args, nodes, refs, cluster, os.path.join(state_dir.name, 'state.json'))
+
+    import main as bot_main  # after the environment is ready
+    bot_main.setup_logs(args.log_level)
+    bot = bot_main.Main()
+
+    tick_durations = defaultdict(list)
+    queued_alerts = []
+    instrument(bot, tick_durations, queued_alerts)
+
+    rss_samples = [rss_mb()]
+    cpu_started, wall_started = time.process_time(), time.monotonic()
+    task = asyncio.create_task(bot.run())
+    try:
+        while time.monotonic() - wall_started < args.duration:
+            await asyncio.sleep(1.0)
+            if task.done():
+                task.result()
+            rss_samples.append(rss_mb())
+        # let the last alerts leave the queue
+        await asyncio.sleep(bot.alert.batch_window + 0.5)
+    finally:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        wall = time.monotonic() - wall_started
+        cpu = time.process_time() - cpu_started
+        await cluster.stop()
+        state_dir.cleanup()
+
+    all_durations = [d for durations in tick_durations.values() for d in durations]
+    total_ticks = len(all_durations)
+    alert_lat, lost = alert_latencies(queued_alerts, cluster.telegram.messages)
+    ticks = summarize(all_durations)
+    alerts = summarize(alert_lat)
+    overruns = sum(entry.overruns for entry in bot.scheduler.entries.values())
+
+    # the fake servers run in the same process, so CPU and RSS include them
+    results = {
+        'ticks': total_ticks,
+        'ticks_per_sec': total_ticks / wall,
+        'tick_p50': ticks.get('p50'),
+        'tick_p90': ticks.get('p90'),
+        'tick_p99': ticks.get('p99'),
+        'tick_max': ticks.get('max'),
+        'overruns': overruns,
+        'upstream_requests_per_sec': cluster.requests / wall,
+        'alerts_queued': len(queued_alerts),
+        'alerts_lost': lost,
+        'messages_sent': len(cluster.telegram.messages),
+        'alert_p50': alerts.get('p50'),
+        'alert_p90': alerts.get('p90'),
+        'alert_max': alerts.get('max'),
+        'cpu_seconds': cpu,
+        'cpu_share': cpu / wall,
+        'cpu_per_tick_ms': cpu / total_ticks * 1000 if total_ticks else None,
+        'rss_start_mb': rss_samples[0],
+        'rss_max_mb': max(rss_samples),
+        'rss_end_mb': rss_samples[-1],
+        'jobs': {name: dict(summarize(durations), ticks_per_sec=len(durations) / wall)
+                 for name, durations in tick_durations.items()},
+        'cache': bot.cache.stats,
+    }
+    return results
+
+
+def params_of(args):
+    return {key: value for key, value in vars(args).items() if key not in ('out', 'compare', 'tolerance', 'log_level')}
+
+
+def print_results(results):
+    print(f"{'metric':<28}{'value':>14}")
+    for key, value in results.items():
+        if isinstance(value, dict):
+            continue
+        text = f'{value:.4f}' if isinstance(value, float) else str(value)
+        print(f'{key:<28}{text:>14}')
+    print()
+    print(f"{'job':<24}{'ticks/s':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, job in results['jobs'].items():
+        if not job['n']:
+            continue
+        print(f"{name:<24}{job['ticks_per_sec']:>10.2f}{job['p50']:>10.4f}{job['p90']:>10.4f}"
+              f"{job['p99']:>10.4f}{job['max']:>10.4f}")
+
+
+def compare(results, params, baseline_path, tolerance):
+    """
+    Prints the change of every metric against a saved run; returns the names of the regressed ones.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get('params') != params:
+        changed = sorted(k for k in set(params) | set(baseline.get('params', {}))
+                         if params.get(k) != baseline.get('params', {}).get(k))
+        print(f"Warning: the parameters differ from the baseline ({', '.join(changed)})")
+
+    regressions = []
+    print(f"\n{'metric':<28}{'baseline':>14}{'now':>14}{'change':>10}")
+    for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        old, new = baseline['results'].get(key), results.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = change > tolerance if key in LOWER_IS_BETTER else change < -tolerance
+        mark = '  REGRESSION' if worse else ''
+        print(f'{key:<28}{old:>14.4f}{new:>14.4f}{change:>+10.1%}{mark}')
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=50, help='fake nodes in the fleet')
+    parser.add_argument('--refs', type=int, default=2, help='fake reference nodes')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to run')
+    parser.add_argument('--period', type=float, default=2.0, help='TICK_PERIOD of all jobs')
+    parser.add_argument('--concurrency', type=int, default=50, help='FLEET_CONCURRENCY')
+    parser.add_argument('--latency', type=float, default=0.02, help='node response latency, sec')
+    parser.add_argument('--ref-latency', type=float, default=0.05, help='reference response latency, sec')
+    parser.add_argument('--jitter', type=float, default=0.01, help='± latency jitter, sec')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with 500')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='sendMessage latency, sec')
+    parser.add_argument('--lagging', type=float, default=0.0, help='share of nodes that lag')
+    parser.add_argument('--lag', type=int, default=20, help='blocks behind for the lagging nodes')
+    parser.add_argument('--drift', type=float, default=0.0, help='extra blocks/min the lagging nodes lose')
+    parser.add_argument('--block-time', type=float, default=6.0, help='fake chain block time, sec')
+    parser.add_argument('--sync-rate', type=float, default=60.0, help='fake Midgard sync progress, %%/h')
+    parser.add_argument('--base-port', type=int, default=19000, help='first port of the fake servers')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra bot settings, e.g. --env ADAPTIVE_MAX_PERIOD=1m')
+    parser.add_argument('--out', help='where to save the results (default: bench/results/<time>.json)')
+    parser.add_argument('--compare', help='a saved result to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative change in --compare')
+    parser.add_argument('--log-level', default='ERROR')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if sys.platform != 'win32':
+        # one socket per fake node and per bot connection
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = min(hard, max(soft, args.nodes * 8 + 256))
+        if wanted > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    results = asyncio.run(run(args))
+    params = params_of(args)
+    print_results(results)
+
+    out = args.out or os.path.join(ROOT, 'bench', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+            },
+            'params': params,
+            'results': results,
+        }, f, indent=2)
+    print(f'\nSaved to {out}')
+
+    if args.compare:
+        regressions = compare(results, params, args.compare, args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
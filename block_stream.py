@@ -0,0 +1,141 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+import aiohttp
+
+import codec
+import metrics
+from logs import WithLogger
+
+
+def parse_height(message: dict) -> Optional[int]:
+    """
+    Height from a NewBlockHeader or NewBlock event of the Tendermint RPC; None for other messages.
+    """
+    value = ((message.get('result') or {}).get('data') or {}).get('value') or {}
+    header = value.get('header') or (value.get('block') or {}).get('header') or {}
+    height = header.get('height')
+    return int(height) if height is not None else None
+
+
+class BlockStream(WithLogger):
+    """
+    Follows the new blocks of one node over its Tendermint RPC websocket.
+    Reconnects with jittered exponential backoff; the backoff is reset once blocks come again.
+    on_stall(stream) is awaited once when no block arrives within stall_timeout() seconds,
+    on_resume(stream) when the next block comes.
+    """
+
+    # headers only: NewBlock carries all the transactions, we need just the height
+    QUERY = "tm.event='NewBlockHeader'"
+
+    def __init__(self, session: aiohttp.ClientSession, url, name='', stall_timeout=lambda: 30.0,
+                 on_stall=None, on_resume=None, backoff=1.0, max_backoff=60.0, heartbeat=20.0):
+        super().__init__()
+        self.session = session
+        self.url = url
+        self.name = name
+        self.stall_timeout = stall_timeout
+        self.on_stall = on_stall
+        self.on_resume = on_resume
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.heartbeat = heartbeat
+
+        self.height: Optional[int] = None
+        self.arrived: Optional[float] = None
+        self.connected = False
+        self.stalled = False
+        self.reconnects = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def fresh(self, max_age: float) -> bool:
+        """
+        True if the pushed height can be trusted instead of polling the node.
+        """
+        return (self.connected and not self.stalled and self.arrived is not None
+                and time.monotonic() - self.arrived <= max_age)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.connected = False
+        metrics.BLOCK_STREAM_UP.remove(node=self.name)
+
+    async def run(self):
+        attempt = 0
+        while True:
+            got_blocks = False
+            try:
+                got_blocks = await self._follow()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"[{self.name}] Websocket {self.url} failed: {e!r}")
+            self._set_connected(False)
+
+            attempt = 0 if got_blocks else attempt + 1
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            self.reconnects += 1
+            self.logger.info(f"[{self.name}] Reconnecting in {delay:.1f} sec")
+            await asyncio.sleep(delay)
+
+    async def _follow(self) -> bool:
+        got_blocks = False
+        async with self.session.ws_connect(self.url, heartbeat=self.heartbeat) as ws:
+            await ws.send_str(codec.dumps_str({
+                'jsonrpc': '2.0', 'method': 'subscribe', 'id': 1, 'params': {'query': self.QUERY},
+            }))
+            self._set_connected(True)
+            self.logger.info(f"[{self.name}] Subscribed to new blocks at {self.url}")
+
+            while True:
+                try:
+                    msg = await ws.receive(timeout=self.stall_timeout())
+                except asyncio.TimeoutError:
+                    await self._stall()
+                    continue
+
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    data = codec.loads(msg.data)
+                    if data.get('error'):
+                        raise Exception(f"Subscription failed: {data['error']}")
+                    height = parse_height(data)
+                    if height is not None:
+                        got_blocks = True
+                        await self._block(height)
+                elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                  aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    return got_blocks
+
+    async def _block(self, height):
+        self.height = height
+        self.arrived = time.monotonic()
+        if self.stalled:
+            self.stalled = False
+            self.logger.info(f"[{self.name}] Blocks are coming again: #{height}")
+            if self.on_resume:
+                await self.on_resume(self)
+
+    async def _stall(self):
+        if self.stalled:
+            return
+        self.stalled = True
+        self.logger.warning(f"[{self.name}] No new block for {self.stall_timeout():.0f} sec")
+        if self.on_stall:
+            await self.on_stall(self)
+
+    def _set_connected(self, connected):
+        self.connected = connected
+        metrics.BLOCK_STREAM_UP.set(1 if connected else 0, node=self.name)
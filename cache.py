@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from logs import WithLogger
+
+
+class ResponseCache(WithLogger):
+    """
+    Short-lived cache of decoded responses keyed by URL, shared by all jobs.
+    Concurrent loads of the same URL are merged into one request.
+    Failures are never cached, but every waiter of a merged request gets the same exception.
+    The request runs in a task of its own: a caller that is cancelled stops waiting, but doesn't cancel it
+    for the others.
+    """
+
+    def __init__(self, ttl: float = 2.0, max_size: int = 10_000):
+        super().__init__()
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}  # url -> (expires_at, data)
+        self._in_flight = {}  # url -> Task
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    async def get(self, url, loader):
+        now = time.monotonic()
+        entry = self._entries.get(url)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        task = self._in_flight.get(url)
+        if task is not None:
+            self.merged += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = self._in_flight[url] = asyncio.ensure_future(self._load(url, loader))
+        # mark the exception as retrieved: nobody may be waiting for it
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _load(self, url, loader):
+        try:
+            data = await loader(url)
+        finally:
+            del self._in_flight[url]
+        self._store(url, data)
+        return data
+
+    def _store(self, url, data):
+        now = time.monotonic()
+        if len(self._entries) >= self.max_size:
+            self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+        if self.ttl > 0:
+            self._entries[url] = (now + self.ttl, data)
+
+    def invalidate(self, url=None):
+        if url is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(url, None)
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses + self.merged
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'merged': self.merged,
+            'hit_ratio': (self.hits + self.merged) / total if total else 0.0,
+            'size': len(self._entries),
+        }
@@ -0,0 +1,39 @@
+"""
+JSON for the bot: orjson when it is installed, the standard library otherwise.
+Both backends take bytes or str; dumps always returns compact UTF-8 bytes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+DecodeError = json.JSONDecodeError  # orjson.JSONDecodeError is a subclass of it
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=_OPTIONS)
+
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode('utf-8')
+
+
+def dumps_str(obj) -> str:
+    """
+    For APIs that want text, e.g. aiohttp's json_serialize.
+    """
+    return dumps(obj).decode('utf-8')
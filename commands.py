@@ -0,0 +1,156 @@
+import asyncio
+import html
+import time
+from typing import Callable, Dict, Iterable, List
+
+import aiohttp
+
+import status
+from alerts import AlertSender, split_message
+from config import KINDS
+from logs import WithLogger
+from utils import format_timedelta, now_ts
+
+STATE_ICONS = {
+    status.OK: '✅',
+    status.ALERT: '🚨',
+    status.ERROR: '❌',
+    status.TIMEOUT: '⌛',
+}
+
+
+class Command:
+    def __init__(self, description, kinds=None, limit=3):
+        self.description = description
+        self.kinds = kinds  # job kinds to show, all jobs if None
+        self.limit = limit  # nodes with problems shown per job
+
+    def matches(self, job):
+        return self.kinds is None or any(isinstance(job, KINDS[kind]) for kind in self.kinds)
+
+
+COMMANDS: Dict[str, Command] = {
+    '/status': Command('state of every job'),
+    '/lag': Command('block lag of the THORNodes and Midgards', ('thor_height', 'midgard_health'), limit=10),
+    '/version': Command('THORNode versions', ('thor_version',), limit=10),
+    '/sync': Command('Midgard sync progress', ('midgard_sync',)),
+}
+
+
+class CommandHandler(WithLogger):
+    """
+    Answers bot commands received with getUpdates long polling.
+    Replies are made from the status snapshots the jobs keep after every tick (AbstractJob.status):
+    a command never makes a request to the nodes, however many people ask.
+    """
+
+    def __init__(self, alert: AlertSender, get_jobs: Callable[[], List], allowed_chats: Iterable[int] = (),
+                 poll_timeout=30, min_interval=3.0, max_age=60.0):
+        super().__init__()
+        self.alert = alert  # its session, token, API URL and sendMessage are reused
+        self.get_jobs = get_jobs
+        self.allowed_chats = set(int(chat) for chat in allowed_chats)  # anyone if empty
+        self.poll_timeout = poll_timeout
+        self.min_interval = min_interval  # per chat: more frequent commands are ignored
+        self.max_age = max_age  # commands sent while the bot was down are ignored if older than this
+
+        self.offset = None
+        self._last_reply_ts = {}  # chat_id -> monotonic time
+        self._replies = set()  # reply tasks in flight
+
+        self.handled = 0
+        self.ignored = 0
+
+    def reply_text(self, command: Command) -> str:
+        jobs = [job for job in self.get_jobs() if command.matches(job)]
+        if not jobs:
+            return 'No such jobs are configured.'
+        return '\n\n'.join(self.describe_job(job, command.limit) for job in jobs)
+
+    @staticmethod
+    def describe_job(job, limit) -> str:
+        snapshot = job.status
+        name = html.escape(job.name)
+        if not snapshot.get('state') or not snapshot.get('finished'):
+            return f'⏳ <b>{name}</b>: no data yet'
+
+        age = format_timedelta(max(0, now_ts() - snapshot['finished']))
+        head = f"{STATE_ICONS.get(snapshot['state'], '❔')} <b>{name}</b> {snapshot['state'].upper()} ({age} ago)"
+        details = status.describe(snapshot, limit)
+        return f'{head}\n{html.escape(details)}' if details else head
+
+    @staticmethod
+    def help_text():
+        lines = [f'{name} - {command.description}' for name, command in COMMANDS.items()]
+        return 'Commands:\n' + '\n'.join(lines)
+
+    async def handle_message(self, message: dict):
+        text = (message.get('text') or '').strip()
+        chat_id = (message.get('chat') or {}).get('id')
+        if not text.startswith('/') or chat_id is None:
+            return
+
+        if self.allowed_chats and chat_id not in self.allowed_chats:
+            self.ignored += 1
+            self.logger.debug(f"Command {text!r} from a foreign chat {chat_id} is ignored")
+            return
+        if now_ts() - message.get('date', 0) > self.max_age:
+            self.ignored += 1
+            return
+        now = time.monotonic()
+        if now - self._last_reply_ts.get(chat_id, -self.min_interval) < self.min_interval:
+            self.ignored += 1
+            return
+        self._last_reply_ts[chat_id] = now
+
+        # "/status@SomeBot args" in groups
+        name = text.split()[0].split('@')[0].lower()
+        command = COMMANDS.get(name)
+        reply = self.reply_text(command) if command else self.help_text()
+        self.handled += 1
+        self.logger.info(f"Command {name} from {chat_id}")
+
+        # replies go out in the background, so that a slow chat doesn't hold the polling
+        task = asyncio.create_task(self.send_reply(chat_id, reply))
+        self._replies.add(task)
+        task.add_done_callback(self._replies.discard)
+
+    async def send_reply(self, chat_id, text):
+        try:
+            for part in split_message(text):
+                await self.alert.telegram_send_message_basic(chat_id, part)
+        except Exception as e:
+            self.logger.warning(f"Failed to reply to {chat_id}: {e!r}")
+
+    async def get_updates(self) -> List[dict]:
+        url = f"{self.alert.api_url}/bot{self.alert.bot_token}/getUpdates"
+        params = {'timeout': self.poll_timeout, 'allowed_updates': '["message"]'}
+        if self.offset is not None:
+            params['offset'] = self.offset
+        timeout = aiohttp.ClientTimeout(total=self.poll_timeout + 10)
+        async with self.alert.session.get(url, params=params, timeout=timeout) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status != 200 or not data.get('ok'):
+                raise Exception(f"getUpdates error {resp.status}: {data.get('description', '')!r}")
+            return data.get('result', [])
+
+    async def run(self):
+        self.logger.info(f"Listening to commands: {', '.join(COMMANDS)}")
+        while True:
+            try:
+                updates = await self.get_updates()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Failed to get commands: {e!r}")
+                await asyncio.sleep(5.0)
+                continue
+
+            for update in updates:
+                self.offset = update['update_id'] + 1
+                message = update.get('message')
+                if message:
+                    try:
+                        await self.handle_message(message)
+                    except Exception as e:
+                        self.logger.exception(f"Failed to handle {message.get('text')!r}: {e!r}")
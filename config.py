@@ -0,0 +1,286 @@
+"""
+Declarative job configuration: a TOML file describing the jobs, their nodes, references, thresholds and periods,
+and where their alerts go.
+
+    [defaults]
+    period = "10s"
+    reference = { quorum = 2, hedge_percentile = 90, deadline = 5 }
+
+    [jobs.thor-height]
+    kind = "thor_height"
+    nodes = ["node1=http://1.2.3.4:1317", "node2=http://5.6.7.8:1317"]
+    references = "https://thornode.ninerealms.com"
+    diff_alert_threshold = 10
+
+    [[routes]]
+    job = "thor-version"
+    chats = [-1001234567890]
+
+See config.example.toml for every key. The file is watched: see ConfigWatcher and Main.apply_config.
+"""
+import asyncio
+import inspect
+import os
+from typing import Callable, List, Optional
+
+from job_midgard_height import JobMidgardHealth
+from job_midgard_sync import JobMidgardSync
+from job_thornode_height import JobThorNodeHeight
+from job_version import JobThorNodeVersion
+from job_watchdog import JobWatchdog
+from logs import WithLogger
+from routing import Route
+from utils import parse_timespan_to_seconds
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+KINDS = {
+    'thor_height': JobThorNodeHeight,
+    'midgard_health': JobMidgardHealth,
+    'thor_version': JobThorNodeVersion,
+    'midgard_sync': JobMidgardSync,
+    'watchdog': JobWatchdog,
+}
+
+# config keys that differ from the names of the constructor parameters
+ALIASES = {
+    'nodes': 'test_url',
+    'references': 'ref_url',
+    'url': 'target_url',
+    'alert_period': 'alert_period_sec',
+    'reference': 'reference_options',
+}
+
+TIMESPANS = {'period', 'alert_period_sec'}
+
+# passed by the bot, not configured
+INJECTED = {'self', 'alert', 'client', 'job_id'}
+
+# these can be changed on a running job; a change of anything else rebuilds it
+RETUNABLE = {'period', 'diff_alert_threshold', 'trend_alert_rate', 'concurrency', 'progress_step', 'stall_blocks'}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def parse_timespan(value, what) -> float:
+    seconds = value if isinstance(value, (int, float)) else parse_timespan_to_seconds(str(value))
+    if isinstance(seconds, str):  # parse_timespan_to_seconds returns its errors
+        raise ConfigError(f'{what}: {seconds}')
+    return float(seconds)
+
+
+class JobSpec:
+    """
+    What a job is built from: its id (also the key of its saved state), kind, constructor parameters
+    and the adaptive polling options (None for off).
+    """
+
+    def __init__(self, job_id: str, kind: str, params: dict, adaptive: dict = None):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.adaptive = adaptive
+
+    def __repr__(self):
+        return f'JobSpec({self.id!r}, {self.kind!r})'
+
+    @property
+    def job_class(self):
+        return KINDS[self.kind]
+
+    def changes(self, other: 'JobSpec') -> set:
+        keys = {key for key in self.params.keys() | other.params.keys()
+                if self.params.get(key) != other.params.get(key)}
+        if self.adaptive != other.adaptive:
+            keys.add('adaptive')
+        return keys
+
+    def retunable(self, other: 'JobSpec') -> bool:
+        return self.kind == other.kind and self.changes(other) <= RETUNABLE | {'adaptive'}
+
+    def validate(self):
+        signature = inspect.signature(self.job_class)
+        known = set(signature.parameters) - INJECTED
+        unknown = set(self.params) - known
+        if unknown:
+            raise ConfigError(f'Job {self.id!r}: unknown keys {", ".join(sorted(unknown))}')
+        missing = [name for name, p in signature.parameters.items()
+                   if name not in INJECTED and p.default is p.empty and name not in self.params]
+        if missing:
+            raise ConfigError(f'Job {self.id!r}: missing {", ".join(missing)}')
+        if self.adaptive and not self.job_class.adaptive:
+            raise ConfigError(f'Job {self.id!r}: {self.kind} does not support adaptive polling')
+
+
+class Config:
+    """
+    The jobs and the alert routes (None if the file has no [[routes]]).
+    """
+
+    def __init__(self, jobs: List[JobSpec], routes: Optional[List[Route]] = None):
+        self.jobs = jobs
+        self.routes = routes
+
+
+def parse_adaptive(table, what):
+    if not table or not table.get('max_period'):
+        return None
+    unknown = set(table) - {'max_period', 'calm_ticks', 'growth'}
+    if unknown:
+        raise ConfigError(f'{what}: unknown adaptive keys {", ".join(sorted(unknown))}')
+    return {
+        'max_period': parse_timespan(table['max_period'], f'{what}: adaptive.max_period'),
+        'calm_ticks': int(table.get('calm_ticks', 3)),
+        'growth': float(table.get('growth', 1.5)),
+    }
+
+
+def parse_params(table: dict, what) -> dict:
+    params = {}
+    for key, value in table.items():
+        key = ALIASES.get(key, key)
+        if key in TIMESPANS:
+            value = parse_timespan(value, f'{what}: {key}')
+        elif key == 'reference_options':
+            value = dict(value)
+            if 'hedge_percentile' in value:  # percents, like REF_HEDGE_PERCENTILE
+                value['hedge_percentile'] = float(value['hedge_percentile']) / 100
+        params[key] = value
+    return params
+
+
+def parse_routes(tables) -> List[Route]:
+    routes = []
+    for i, table in enumerate(tables, start=1):
+        try:
+            routes.append(Route.from_table(table))
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f'Route #{i}: {e}') from e
+    return routes
+
+
+def parse_config(data: dict) -> Config:
+    defaults = dict(data.get('defaults', {}))
+    default_adaptive = parse_adaptive(defaults.pop('adaptive', None), 'defaults')
+    defaults = parse_params(defaults, 'defaults')
+
+    jobs = data.get('jobs')
+    if not jobs:
+        raise ConfigError('No [jobs.<id>] tables')
+
+    specs = []
+    for job_id, table in jobs.items():
+        table = dict(table)
+        if not table.pop('enabled', True):
+            continue
+        kind = table.pop('kind', None)
+        if kind not in KINDS:
+            raise ConfigError(f'Job {job_id!r}: kind must be one of {", ".join(KINDS)}, not {kind!r}')
+
+        if 'adaptive' in table:
+            adaptive = parse_adaptive(table.pop('adaptive'), f'Job {job_id!r}')
+        else:
+            adaptive = default_adaptive if KINDS[kind].adaptive else None
+
+        # the defaults only go where they make sense
+        accepted = inspect.signature(KINDS[kind]).parameters
+        params = {key: value for key, value in defaults.items() if key in accepted}
+        params.update(parse_params(table, f'Job {job_id!r}'))
+
+        spec = JobSpec(job_id, kind, params, adaptive)
+        spec.validate()
+        specs.append(spec)
+
+    routes = parse_routes(data['routes']) if 'routes' in data else None
+    return Config(specs, routes)
+
+
+def load_config(path) -> Config:
+    with open(path, 'rb') as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ConfigError(f'{path}: {e}') from e
+    return parse_config(data)
+
+
+def build_job(spec: JobSpec, alert, client, one_shot=False):
+    params = dict(spec.params)
+    if one_shot:
+        params.pop('rpc_ws_port', None)  # the one-shot check has no time to wait for pushed blocks
+    if 'client' in inspect.signature(spec.job_class).parameters:
+        params['client'] = client
+    job = spec.job_class(alert, job_id=spec.id, **params)
+    if spec.adaptive:
+        job.set_adaptive(**spec.adaptive)
+    return job
+
+
+def retune_job(job, old: JobSpec, new: JobSpec):
+    """
+    Applies the RETUNABLE changes to a running job. Returns True if its period has changed.
+    """
+    changes = old.changes(new)
+    defaults = inspect.signature(new.job_class).parameters
+    for key in changes & RETUNABLE:
+        value = new.params.get(key, defaults[key].default)  # a removed key goes back to the default
+        if key != 'period':
+            setattr(job, key, value)
+
+    old_period = job.period
+    if 'period' in changes:
+        job.set_period(new.params.get('period', defaults['period'].default))
+    if changes & {'period', 'adaptive'}:
+        if new.adaptive:
+            job.set_adaptive(**new.adaptive)
+        else:
+            job.set_adaptive(0)
+        job.period = job.base_period
+    return job.period != old_period
+
+
+class ConfigWatcher(WithLogger):
+    """
+    Polls the modification time of the config file and hands the new Config to on_change(config).
+    A broken file is reported and ignored: the jobs keep running as they are.
+    """
+
+    def __init__(self, path, on_change: Callable, interval=5.0):
+        super().__init__()
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.mtime = self._mtime()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    async def check(self):
+        mtime = self._mtime()
+        if mtime is None or mtime == self.mtime:
+            return
+        self.mtime = mtime
+        try:
+            new_config = load_config(self.path)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Config {self.path} is not applied: {e}")
+            return
+        self.logger.info(f"Config {self.path} has changed")
+        await self.on_change(new_config)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                self.logger.exception(f"Failed to apply config {self.path}: {e!r}")
+
@@ -28,3 +28,11 @@ class Cooldown:
 
     def reset_duration(self):
         self.duration = self.start_duration
+
+    def to_dict(self):
+        return {'last_time': self.last_time, 'duration': self.duration}
+
+    def load(self, d: dict):
+        self.last_time = d.get('last_time')
+        self.duration = min(max(float(d.get('duration', self.start_duration)), self.start_duration),
+                            self.max_duration)
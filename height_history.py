@@ -0,0 +1,117 @@
+from typing import Dict, Optional
+
+from series import TimeSeries
+from utils import BLOCK_TIME, MINUTE, format_timedelta
+
+
+class LagTrend:
+    def __init__(self, lag: float, ref_rate: Optional[float], node_rate: Optional[float]):
+        self.lag = lag
+        self.ref_rate = ref_rate  # blocks/sec
+        self.node_rate = node_rate  # blocks/sec
+
+    @property
+    def known(self):
+        return self.ref_rate is not None and self.node_rate is not None
+
+    @property
+    def lag_rate(self) -> Optional[float]:
+        """
+        How fast the lag grows, blocks/sec (negative: the node is catching up).
+        """
+        return self.ref_rate - self.node_rate if self.known else None
+
+    @property
+    def lag_rate_per_min(self) -> Optional[float]:
+        return self.lag_rate * MINUTE if self.known else None
+
+    @property
+    def catch_up_time(self) -> Optional[float]:
+        """
+        Seconds until the lag is gone at the current rates, None if it is not shrinking.
+        """
+        if not self.known or self.lag <= 0 or self.lag_rate >= 0:
+            return None
+        return self.lag / -self.lag_rate
+
+    def describe(self):
+        if not self.known:
+            return 'no trend yet'
+        rate = self.lag_rate_per_min
+        if rate > 0.05:
+            return f"falling behind at {rate:.1f} blocks/min"
+        if rate < -0.05:
+            return f"catching up at {-rate:.1f} blocks/min"
+        return "lag is stable"
+
+    def summary(self):
+        """
+        One sentence for an alert, empty if there is not enough history yet.
+        """
+        if not self.known:
+            return ''
+        text = self.describe().capitalize()
+        if self.catch_up_time is not None:
+            text += f", catch-up in ≈{format_timedelta(round(self.catch_up_time))}"
+        return text + '.'
+
+
+class HeightHistory:
+    """
+    Recent (timestamp, height) samples of the reference and of every node, in array-backed ring buffers.
+    Timestamps are the response arrival times (time.monotonic).
+    """
+
+    def __init__(self, capacity: int = 180, min_interval: float = 5.0,
+                 window: float = 5 * MINUTE, min_span: float = 2 * MINUTE):
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self.window = window
+        self.min_span = min_span
+        self.ref = TimeSeries(capacity, min_interval)
+        self.nodes: Dict[str, TimeSeries] = {}
+
+    def _series(self, name):
+        series = self.nodes.get(name)
+        if series is None:
+            series = self.nodes[name] = TimeSeries(self.capacity, self.min_interval)
+        return series
+
+    def add_ref(self, ts: float, height: float):
+        last = self.ref.last()
+        if last is None or ts > last[0]:
+            self.ref.append(ts, height)
+
+    def add(self, name: str, ts: float, height: float):
+        self._series(name).append(ts, height)
+
+    def forget(self, name: str):
+        self.nodes.pop(name, None)
+
+    def block_rate(self, series: TimeSeries) -> Optional[float]:
+        return series.slope(self.window, self.min_span)
+
+    def ref_rate(self) -> Optional[float]:
+        """
+        Blocks/sec of the reference; a least-squares fit, so take it once per tick and pass it around.
+        """
+        return self.block_rate(self.ref)
+
+    @staticmethod
+    def block_time_at(ref_rate: Optional[float]) -> float:
+        return 1.0 / ref_rate if ref_rate and ref_rate > 0 else BLOCK_TIME
+
+    @property
+    def block_time(self) -> float:
+        """
+        Measured seconds per block of the reference, BLOCK_TIME until there is enough history.
+        """
+        return self.block_time_at(self.ref_rate())
+
+    def trend(self, name: str, lag: float, ref_rate: Optional[float]) -> LagTrend:
+        series = self.nodes.get(name)
+        return LagTrend(
+            lag,
+            ref_rate,
+            self.block_rate(series) if series is not None else None,
+        )
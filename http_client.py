@@ -0,0 +1,167 @@
+import asyncio
+import random
+import time
+from contextlib import nullcontext
+from typing import Dict, Optional
+from urllib import parse
+
+import aiohttp
+
+import codec
+import metrics
+from cache import ResponseCache
+from logs import WithLogger
+from profiling import TickProfile
+
+
+class HttpStatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f'Status is not OK ({status})')
+        self.status = status
+
+
+class EndpointPolicy:
+    def __init__(self, connect_timeout: float = 3.0, read_timeout: float = 5.0, total_timeout: float = 15.0,
+                 retries: int = 2, backoff: float = 0.3, max_backoff: float = 3.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout, sock_connect=connect_timeout, sock_read=read_timeout,
+        )
+
+    @property
+    def budget(self) -> float:
+        # the whole request, retries included, ends within total_timeout
+        return self.total_timeout
+
+    @property
+    def attempt_time(self) -> float:
+        # what an attempt may take before it times out
+        return min(self.connect_timeout + self.read_timeout, self.total_timeout)
+
+    def delay(self, attempt: int) -> float:
+        # "full jitter": spreads the retries of many nodes failing at once
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @classmethod
+    def parse(cls, spec: str, default: 'EndpointPolicy'):
+        """
+        "connect/read[/retries]" in seconds, e.g. "3/10/1".
+        """
+        parts = [p for p in spec.split('/') if p]
+        connect = float(parts[0]) if len(parts) > 0 else default.connect_timeout
+        read = float(parts[1]) if len(parts) > 1 else default.read_timeout
+        retries = int(parts[2]) if len(parts) > 2 else default.retries
+        return cls(connect, read, max(default.total_timeout, connect + read), retries,
+                   default.backoff, default.max_backoff)
+
+
+class HttpClient(WithLogger):
+    """
+    The one HTTP client of the bot: a pooled keep-alive session with a DNS cache,
+    per-endpoint (host) timeouts and bounded retries with jittered backoff,
+    and the shared short-TTL response cache in front of it.
+    """
+
+    def __init__(self, default_policy: EndpointPolicy = None, policies: Dict[str, EndpointPolicy] = None,
+                 cache: Optional[ResponseCache] = None,
+                 limit: int = 100, limit_per_host: int = 10, keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: int = 300, trace_configs=None):
+        super().__init__()
+        self.default_policy = default_policy or EndpointPolicy()
+        self.policies = policies or {}
+        self.cache = cache
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=limit,
+                limit_per_host=limit_per_host,
+                keepalive_timeout=keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=dns_cache_ttl,
+            ),
+            timeout=self.default_policy.timeout,
+            json_serialize=codec.dumps_str,
+            trace_configs=trace_configs,
+        )
+        self.retries_done = 0
+
+    @staticmethod
+    def parse_policies(spec: str, default: EndpointPolicy) -> Dict[str, EndpointPolicy]:
+        """
+        "host[:port]=connect/read[/retries],..." e.g. "thornode.ninerealms.com=5/15/1,10.0.0.1:1317=1/3"
+        """
+        policies = {}
+        for item in (spec or '').replace(' ', '').split(','):
+            host, sep, policy = item.partition('=')
+            if sep and host:
+                policies[host.lower()] = EndpointPolicy.parse(policy, default)
+        return policies
+
+    def policy_for(self, url: str) -> EndpointPolicy:
+        parsed = parse.urlparse(url)
+        return (self.policies.get(parsed.netloc.lower())
+                or self.policies.get((parsed.hostname or '').lower())
+                or self.default_policy)
+
+    async def get_json(self, url: str, profile: Optional[TickProfile] = None, side: str = 'test'):
+        if self.cache is not None:
+            return await self.cache.get(url, lambda u: self._get_json_with_retries(u, profile, side))
+        return await self._get_json_with_retries(url, profile, side)
+
+    @staticmethod
+    def _retryable(e: Exception):
+        if isinstance(e, HttpStatusError):
+            return e.status >= 500 or e.status == 429
+        return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    async def _get_json_with_retries(self, url, profile, side):
+        policy = self.policy_for(url)
+        deadline = time.monotonic() + policy.budget
+        for attempt in range(policy.retries + 1):
+            try:
+                return await asyncio.wait_for(self._get_json(url, policy, profile, side),
+                                              max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                if attempt >= policy.retries or not self._retryable(e):
+                    raise
+                delay = policy.delay(attempt)
+                if deadline - time.monotonic() < delay + policy.attempt_time:
+                    raise  # another attempt would not fit in the budget
+                self.retries_done += 1
+                self.logger.debug("Retrying %s in %.2f sec after %s", url, delay, type(e).__name__)
+                await asyncio.sleep(delay)
+
+    async def _get_json(self, url, policy: EndpointPolicy, profile: Optional[TickProfile], side):
+        upstream = parse.urlparse(url).netloc
+        trace_ctx = profile.request_ctx(side) if profile else None
+        started = time.monotonic()
+        error_kind = None
+        try:
+            async with self.session.get(url, timeout=policy.timeout, trace_request_ctx=trace_ctx) as resp:
+                with self._span(profile, f'{side}.body'):
+                    body = await resp.read()
+                if resp.status != 200:
+                    error_kind = f'http_{resp.status}'
+                    raise HttpStatusError(resp.status)
+                with self._span(profile, 'bot.decode'):
+                    data = codec.loads(body)
+                if isinstance(data, str):
+                    error_kind = 'unexpected_text'
+                    raise Exception(f'Unexpected text: <code>{data[:120]}</code>')
+                return data
+        except Exception as e:
+            metrics.HTTP_ERRORS.inc(upstream=upstream, kind=error_kind or type(e).__name__)
+            raise
+        finally:
+            metrics.HTTP_LATENCY.observe(time.monotonic() - started, upstream=upstream)
+
+    @staticmethod
+    def _span(profile: Optional[TickProfile], phase):
+        return profile.span(phase) if profile else nullcontext()
+
+    async def close(self):
+        await self.session.close()
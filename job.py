@@ -1,57 +1,344 @@
 import asyncio
+import statistics
+import time
 from abc import ABCMeta, abstractmethod
-from typing import Optional
-
-from aiohttp import ClientSession
+from contextlib import contextmanager
+from typing import Optional, List, Tuple
 
+import metrics
+import status
 from alerts import AlertSender
+from http_client import HttpClient
 from logs import WithLogger
-from utils import DAY
+from node import Node
+from profiling import TickProfile, TickProfiler
+from utils import DAY, now_ts
+
+DEFAULT_CONCURRENCY = 50
+
+# adaptive polling: a diff below this fraction of the alert threshold counts as calm
+CALM_DIFF_FRACTION = 0.5
+
+
+class Timed:
+    def __init__(self, value=None, started=0.0, arrived=0.0):
+        self.value = value
+        self.started = started
+        self.arrived = arrived
+
+    @property
+    def latency(self):
+        return self.arrived - self.started
+
+    @property
+    def ok(self):
+        return self.value is not None
+
+    def map(self, fn):
+        return Timed(fn(self.value) if self.ok else None, self.started, self.arrived)
+
+
+class PairedFetch:
+    def __init__(self, test: Timed, ref: Timed):
+        self.test = test
+        self.ref = ref
+
+    @property
+    def ok(self):
+        return self.test.ok and self.ref.ok
+
+    def map(self, fn):
+        return PairedFetch(self.test.map(fn), self.ref.map(fn))
+
+    @property
+    def gap(self):
+        # positive if the reference answered later than the test node
+        return self.ref.arrived - self.test.arrived
+
+    def corrected_diff(self, block_time: float):
+        """
+        Height diff (ref - test) with the part explained by the arrival gap removed:
+        if the reference answered `gap` seconds later, it had gap / block_time more blocks to produce.
+        """
+        return (self.ref.value - self.test.value) - self.gap / block_time
 
 
 class AbstractJob(WithLogger, metaclass=ABCMeta):
-    def __init__(self, alert: AlertSender, period: float, session: Optional[ClientSession] = None):
+    adaptive = True  # may poll less often while everything is calm, see set_adaptive
+    one_shot = True  # takes part in the one-shot check (main.py --once)
+
+    def __init__(self, alert: AlertSender, period: float, client: Optional[HttpClient] = None, job_id=None):
+        self.job_id = job_id  # unique among the configured jobs; the class name by default
         super().__init__()
         self.tick_no = 0
         self.alert = alert
-        self.session = session
-        self.period = period
-        if self.period < 1:
-            self.logger.warning(f"Period is too low: {self.period} sec. Setting to 1 sec.")
-            self.period = 1
-        elif self.period > DAY:
-            self.logger.warning(f"Period is too high: {self.period} sec. Setting to 1 day.")
-            self.period = DAY
+        self.client = client
+        self.concurrency = DEFAULT_CONCURRENCY
+        self.nodes: List[Node] = []  # the watched fleet, if any
+        self.reference_urls = set()
+        self.references = None  # ReferencePool
+        self.profile: Optional[TickProfile] = None
+        self.profiler = TickProfiler(self.logger)
+        self.latency = {}
+        self.period = self.base_period = self.max_period = 0.0  # no adaptive polling until set_adaptive
+        self.set_period(period)
+        self.calm_ticks = 3
+        self.growth = 1.5
+        self.calm_streak = 0
+        self.urgent_reasons = set()
+
+        self.status = {'job': self.name, 'state': None}  # snapshot of the last tick, see make_status
+        self._tick_alerts = []
+        self._node_status = {}
+
+    def set_period(self, period: float):
+        """
+        Sets the base period; the job starts polling at it right away, the scheduler has to be told separately.
+        """
+        if period < 1:
+            self.logger.warning(f"Period is too low: {period} sec. Setting to 1 sec.")
+            period = 1
+        elif period > DAY:
+            self.logger.warning(f"Period is too high: {period} sec. Setting to 1 day.")
+            period = DAY
+
+        adaptive = self.max_period > self.base_period
+        self.period = self.base_period = period
+        self.max_period = max(self.max_period, period) if adaptive else period
+        self.calm_streak = 0
+
+    def set_adaptive(self, max_period: float, calm_ticks=3, growth=1.5):
+        """
+        After every `calm_ticks` calm ticks in a row the period grows by `growth`, up to max_period.
+        Any urgent tick (see mark_urgent) snaps it back to the base period at once.
+        """
+        self.max_period = max(self.base_period, min(max_period, DAY))
+        self.calm_ticks = max(1, calm_ticks)
+        self.growth = max(1.0, growth)
+
+    def mark_urgent(self, reason):
+        """
+        Something needs a close look: poll at the base period. Every raised alert counts as urgent.
+        """
+        self.urgent_reasons.add(reason)
+
+    def adapt_period(self):
+        if self.max_period <= self.base_period:
+            return
+
+        old_period = self.period
+        if self.urgent_reasons:
+            self.calm_streak = 0
+            self.period = self.base_period
+        else:
+            self.calm_streak += 1
+            if self.calm_streak >= self.calm_ticks:
+                self.calm_streak = 0
+                self.period = min(self.period * self.growth, self.max_period)
+
+        if self.period < old_period:
+            self.logger.info(f"Polling every {self.period:.1f} sec again "
+                             f"({', '.join(sorted(self.urgent_reasons))})")
+        elif self.period > old_period:
+            self.logger.info(f"All calm, polling every {self.period:.1f} sec")
 
     @abstractmethod
     async def tick(self):
         ...
 
+    async def run_tick(self):
+        started = time.monotonic()
+        profile = self.profile = TickProfile(self.tick_no)
+        error = None
+        try:
+            self.logger.debug("Tick #%d", self.tick_no)
+            self.latency = {}
+            self.urgent_reasons.clear()
+            self._tick_alerts = []
+            self._node_status = {}
+            await self.tick()
+            self.logger.info("Tick #%d done", self.tick_no)
+            await self.clear_alert('loop_error')
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            metrics.TICK_ERRORS.inc(job=self.name)
+            self.logger.exception(f"Error in the loop: {e!r}")
+            await self.raise_alert('loop_error', f"🚨 [{self.name}] Error in the loop: {type(e).__name__}")
+        finally:
+            duration = time.monotonic() - started
+            self.status = self.make_status(duration, error)
+            metrics.TICK_DURATION.observe(duration, job=self.name)
+            self.profiler.finish(profile, self.period)
+            self.adapt_period()
+            self.tick_no += 1
+
+    def report(self, node: Optional[Node], text, ok=True):
+        """
+        Short state of one node for the status snapshot (the one-shot table, bot commands).
+        """
+        self._node_status[node.name if node else ''] = {'text': text, 'ok': ok}
+
+    def make_status(self, duration: float, error: Optional[str] = None) -> dict:
+        if error:
+            state = status.ERROR
+        elif self._tick_alerts:
+            state = status.ALERT
+        else:
+            state = status.OK
+        return {
+            'job': self.name,
+            'state': state,
+            'tick': self.tick_no,
+            'duration': duration,
+            'finished': now_ts(),
+            'alerts': list(self._tick_alerts),
+            'nodes': dict(self._node_status),
+            'error': error,
+        }
+
     async def run(self):
+        """
+        Standalone loop; the bot itself runs jobs with the Scheduler, which keeps fixed deadlines.
+        """
         self.logger.info(f"Starting job with period {self.period} sec")
         while True:
-            try:
-                self.logger.debug(f"Tick #{self.tick_no}")
-                await self.tick()
-                self.logger.info(f"Tick #{self.tick_no} done")
-            except Exception as e:
-                self.logger.exception(f"Error in the loop: {e!r}")
-                await self.alert.send(f"🚨Error in the loop: {type(e).__name__}")
+            await self.run_tick()
             await asyncio.sleep(self.period)
-            self.tick_no += 1
+
+    @property
+    def logger_prefix(self):
+        return f'{self.job_id}:' if self.job_id and self.job_id != self.__class__.__name__ else ''
 
     @property
     def name(self):
-        return self.__class__.__name__
+        return self.job_id or self.__class__.__name__
+
+    @property
+    def state_key(self):
+        return f'job:{self.name}'
+
+    async def close(self):
+        """
+        Releases what the job holds open between ticks.
+        """
+
+    def get_state(self) -> Optional[dict]:
+        """
+        State to survive restarts; see StateStore.register.
+        """
+        return None
+
+    def set_state(self, state: dict):
+        ...
+
+    def alert_key(self, condition, node: Optional[Node] = None):
+        return self.alert.suppressor.make_key(self.name, node.name if node else None, condition)
+
+    async def raise_alert(self, condition, text, node: Optional[Node] = None):
+        """
+        Sends the alert unless the same condition for this job/node is already active and still cooling down.
+        """
+        self.mark_urgent(condition)
+        self._tick_alerts.append(f"{condition} ({node.name})" if node else condition)
+        with self.span('bot.alert'):
+            return await self.alert.suppressor.fire(self.alert_key(condition, node), text)
+
+    async def clear_alert(self, condition, node: Optional[Node] = None, text=None):
+        """
+        Sends one "resolved" message if the condition was active.
+        """
+        with self.span('bot.alert'):
+            return await self.alert.suppressor.resolve(self.alert_key(condition, node), text)
+
+    @contextmanager
+    def span(self, phase):
+        if self.profile is None:
+            yield
+        else:
+            with self.profile.span(phase):
+                yield
+
+    async def timed_node(self, node: Node, coro) -> Timed:
+        """
+        Awaits the read of one node and returns its value with the request and arrival times.
+        The read may take up to the tick period: a node that hangs gets its own fetch alert and no value,
+        instead of holding up the whole fleet.
+        """
+        started = time.monotonic()
+        try:
+            value = await asyncio.wait_for(coro, self.period)
+        except asyncio.TimeoutError:
+            value = None
+            text = f"⌛ [{self.name}] {node.label} did not answer within {self.period:.0f} sec"
+            self.logger.warning(text)
+            await self.raise_alert('fetch', text, node)
+        return Timed(value, started, time.monotonic())
+
+    async def fetch_pair(self, test_query, ref_query) -> PairedFetch:
+        """
+        Reads the test and the reference side at the same time, so neither waits for the other
+        and both values are taken at (nearly) the same moment. Both queries must return a Timed.
+        """
+        test, ref = await asyncio.gather(test_query, ref_query)
+        pair = PairedFetch(test, ref)
+        self.latency = {'test': test.latency, 'ref': ref.latency}
+        self.logger.debug("Latency: test = %.3f sec, ref = %.3f sec, gap = %+.3f sec",
+                          test.latency, ref.latency, pair.gap)
+        return pair
+
+    async def fan_out(self, items, fn):
+        """
+        Runs fn(item) for all items with at most self.concurrency of them in flight.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def one(item):
+            async with semaphore:
+                return await fn(item)
+
+        return await asyncio.gather(*(one(item) for item in items))
+
+    async def fetch_fleet(self, nodes: List[Node], fetch_test, ref_query) -> List[Tuple[Node, PairedFetch]]:
+        """
+        The reference is read once and shared by all nodes; the nodes are read concurrently at the same time,
+        each within the tick period (see timed_node).
+        """
+        if len(nodes) == 1:
+            node = nodes[0]
+            return [(node, await self.fetch_pair(self.timed_node(node, fetch_test(node)), ref_query))]
+
+        ref, tests = await asyncio.gather(
+            ref_query,
+            self.fan_out(nodes, lambda node: self.timed_node(node, fetch_test(node))),
+        )
+
+        latencies = [t.latency for t in tests]
+        self.latency = {
+            'ref': ref.latency,
+            'test': statistics.median(latencies),
+            'test_max': max(latencies),
+        }
+        self.logger.debug("Latency: %d nodes, test median = %.3f sec, test max = %.3f sec, ref = %.3f sec",
+                          len(nodes), self.latency['test'], self.latency['test_max'], ref.latency)
+        return [(node, PairedFetch(test, ref)) for node, test in zip(nodes, tests)]
+
+    async def query_references(self, tag) -> Timed:
+        """
+        Consensus of the reference pool; alerts only when none of the references answered.
+        """
+        ref = await self.references.query()
+        if ref.ok:
+            await self.clear_alert('fetch')
+        else:
+            names = ', '.join(node.name for node in self.references.nodes)
+            await self.raise_alert('fetch', f"🚨 [{tag}] No reference node answered in time ({names})")
+        return ref
 
     async def get_url_contents(self, url):
-        if not self.session:
-            raise Exception("No session provided!")
-
-        async with self.session.get(url) as resp:
-            data = await resp.json()
-            if resp.status != 200:
-                raise Exception(f'Status is not OK ({resp.status}))')
-            if isinstance(data, str):
-                raise Exception(f'Unexpected text: <code>{data[:120]}</code>')
-            return data
+        if not self.client:
+            raise Exception("No HTTP client provided!")
+
+        return await self.client.get_json(url, self.profile, self.upstream_side(url))
+
+    def upstream_side(self, url):
+        return 'ref' if url in self.reference_urls else 'test'
@@ -0,0 +1,68 @@
+from typing import Optional, Tuple
+
+import metrics
+from height_history import HeightHistory
+from job import AbstractJob, PairedFetch, Timed, CALM_DIFF_FRACTION
+from node import Node
+
+
+class HeightJob(AbstractJob):
+    """
+    Common part of the jobs that compare the heights of a fleet with the reference:
+    the corrected lag, its trend and the lag/falling_behind alerts.
+    Subclasses set self.history, diff_alert_threshold and trend_alert_rate (blocks/min), and the wording below.
+    """
+
+    TAG = ''  # in the alert texts: [THOR], [MDG]
+    DIFF_NAME = 'Height diff'
+    TREND_SUBJECT = 'Node'  # "<subject> is falling behind"
+
+    history: HeightHistory
+
+    def track_reference(self, ref: Timed) -> Tuple[Optional[float], float]:
+        """
+        Adds the reference height of the tick (shared by all nodes) to the history.
+        Returns the reference rate (blocks/sec) and the block time for this tick: fitted once, used for every node.
+        """
+        if ref.ok:
+            self.history.add_ref(ref.arrived, ref.value)
+        ref_rate = self.history.ref_rate()
+        return ref_rate, self.history.block_time_at(ref_rate)
+
+    async def check_heights(self, node: Node, heights: PairedFetch, ref_rate, block_time):
+        test_height, ref_height = heights.test.value, heights.ref.value
+        self.history.add(node.name, heights.test.arrived, test_height)
+
+        # the raw diff also contains blocks produced between the two responses; don't count them
+        lag = heights.corrected_diff(block_time)
+        trend = self.history.trend(node.name, lag, ref_rate)
+        diff = round(abs(lag))
+        metrics.HEIGHT_DIFF.set(diff, job=self.name, node=node.name)
+        time_delta = round(diff * block_time)
+
+        trend_text = trend.describe()
+        self.logger.info("[%s] %s: %d (ref = %s vs test = %s, gap %+.2f sec) ≈%d sec; %s",
+                         node.name, self.DIFF_NAME, diff, ref_height, test_height, heights.gap, time_delta, trend_text)
+        self.report(node, f"diff {diff} blocks, {trend_text}", ok=diff < self.diff_alert_threshold)
+
+        falling_behind = trend.known and lag >= 1 and trend.lag_rate_per_min >= self.trend_alert_rate
+        if diff >= self.diff_alert_threshold * CALM_DIFF_FRACTION or (
+                trend.known and lag >= 1 and trend.lag_rate_per_min >= self.trend_alert_rate * CALM_DIFF_FRACTION):
+            self.mark_urgent('lag')
+
+        if diff >= self.diff_alert_threshold:
+            text = (f"🚨 [{self.TAG}] {node.label}: {self.DIFF_NAME} is more than {self.diff_alert_threshold} blocks "
+                    f"<b>({diff} blocks, {time_delta} sec)</b> (test={test_height} vs ref={ref_height})!\n"
+                    f"{trend.summary()}").rstrip()
+            await self.raise_alert('lag', text, node)
+        else:
+            await self.clear_alert('lag', node, f"✅ [{self.TAG}] {node.label}: {self.DIFF_NAME} is back to {diff}.")
+
+        if falling_behind:
+            text = (f"📉 [{self.TAG}] {node.label}: {self.TREND_SUBJECT} is {trend_text} "
+                    f"(lag {diff} blocks, node {trend.node_rate * 60:.1f} vs ref {trend.ref_rate * 60:.1f} blocks/min)")
+            await self.raise_alert('falling_behind', text, node)
+        else:
+            await self.clear_alert('falling_behind', node,
+                                   f"✅ [{self.TAG}] {node.label}: {self.TREND_SUBJECT} is no longer falling behind "
+                                   f"({diff} blocks).")
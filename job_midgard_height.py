@@ -1,74 +1,87 @@
-from aiohttp import ClientSession
-
 from alerts import AlertSender
-from cooldown import Cooldown
-from job import AbstractJob
-from job_thornode_height import BLOCK_TIME
+from height_history import HeightHistory
+from http_client import HttpClient
+from job import DEFAULT_CONCURRENCY, PairedFetch
+from job_height import HeightJob
+from node import Node
+from reference import ReferencePool, median_by
 from utils import normalize_url
 
 
-class JobMidgardHealth(AbstractJob):
-    def __init__(self, alert: AlertSender, session: ClientSession, test_url, ref_url, period=10.0,
-                 diff_alert_threshold=10, cooldown=10):
-        super().__init__(alert, period, session)
-        self.session = session
-        self.test_url = self.fix_url(test_url)
-        self.ref_url = self.fix_url(ref_url)
+class JobMidgardHealth(HeightJob):
+    TAG = 'MDG'
+    DIFF_NAME = 'Aggregated height diff'
+    TREND_SUBJECT = 'Aggregation'
+
+    def __init__(self, alert: AlertSender, client: HttpClient, test_url, ref_url, period=10.0,
+                 diff_alert_threshold=10, concurrency=DEFAULT_CONCURRENCY, trend_alert_rate=1.0,
+                 reference_options=None, job_id=None):
+        super().__init__(alert, period, client, job_id)
+        self.nodes = Node.parse_list(test_url, self.fix_url)
+        if not self.nodes:
+            raise ValueError('No test nodes configured')
+        self.references = ReferencePool(
+            Node.parse_list(ref_url, self.fix_url), self.get_url_contents, median_by(self.aggregated_height),
+            name=self.name, **(reference_options or {}),
+        )
+        self.reference_urls.update(self.references.urls)
         self.diff_alert_threshold = diff_alert_threshold
-        self.cd = Cooldown(self.name, cooldown)
+        self.concurrency = concurrency
+        self.trend_alert_rate = trend_alert_rate  # blocks/min
+        self.history = HeightHistory()
 
     @staticmethod
     def fix_url(url: str):
         return normalize_url(url, '/v2/health')
 
-    async def get_health(self, url):
+    @staticmethod
+    def aggregated_height(health: dict):
+        return health.get('lastAggregated', {}).get('height', 0)
+
+    async def get_health(self, url, node: Node):
         try:
-            return await self.get_url_contents(url)
+            health = await self.get_url_contents(url)
         except Exception as e:
-            text = f"🚨 [MDG] Error loading URL: {self.test_url}: {type(e).__name__}"
+            text = f"🚨 [MDG] Error loading URL: {node.label} ({url}): {type(e).__name__}"
             self.logger.exception(text)
-            await self.alert.send(text)
+            await self.raise_alert('fetch', text, node)
+        else:
+            await self.clear_alert('fetch', node)
+            return health
 
     async def tick(self):
-        if not self.cd.ready:
-            return
+        results = await self.fetch_fleet(
+            self.nodes,
+            lambda node: self.get_health(node.url, node),
+            self.query_references('MDG'),
+        )
+        ref_rate, block_time = self.track_reference(results[0][1].ref.map(self.aggregated_height))
+        for node, pair in results:
+            await self.check_node(node, pair, ref_rate, block_time)
 
-        test_health = await self.get_health(self.test_url)
+    async def check_node(self, node: Node, pair: PairedFetch, ref_rate, block_time):
+        test_health, ref_health = pair.test.value, pair.ref.value
 
-        self.logger.info(f"Test health: {test_health}")
+        self.logger.info("[%s] Test health: %s", node.name, test_health)
         if test_health is None:
-            self.cd.grow_duration()
+            self.report(node, 'no data', ok=False)
             return
 
         if not test_health.get('database', False):
-            await self.alert.send(f"🚨 [MDG] Test URL {self.test_url} has no database connection!")
-            self.cd.grow_duration()
+            await self.raise_alert('database', f"🚨 [MDG] {node.label}: Test URL {node.url} has no database connection!",
+                                   node)
+            self.report(node, 'no database', ok=False)
             return
+        await self.clear_alert('database', node)
 
         if not test_health.get('inSync', False):
-            await self.alert.send(f"🚨 [MDG] Test URL {self.test_url} is out of sync!")
-            self.cd.grow_duration()
+            await self.raise_alert('sync', f"🚨 [MDG] {node.label}: Test URL {node.url} is out of sync!", node)
+            self.report(node, 'out of sync', ok=False)
             return
+        await self.clear_alert('sync', node)
 
-        ref_health = await self.get_health(self.ref_url)
         if ref_health is None:
+            self.report(node, 'no reference', ok=False)
             return
 
-        test_last_aggr_height = test_health.get('lastAggregated', {}).get('height', 0)
-        ref_last_aggr_height = ref_health.get('lastAggregated', {}).get('height', 0)
-        diff = abs(test_last_aggr_height - ref_last_aggr_height)
-        time_delta = diff * BLOCK_TIME
-
-        self.logger.info(
-            f"Aggregated height diff: {diff} "
-            f"(ref = {ref_last_aggr_height} vs test = {test_last_aggr_height})"
-        )
-
-        if diff >= self.diff_alert_threshold:
-            text = (f"🚨 [MDG] Aggregated height diff is more than {self.diff_alert_threshold} blocks: "
-                    f" <b>({diff} blocks | {time_delta} sec)</b>"
-                    f" (test={test_last_aggr_height} vs ref={ref_last_aggr_height})!")
-            self.logger.warning(text)
-            await self.alert.send(text)
-            return
-
+        await self.check_heights(node, pair.map(self.aggregated_height), ref_rate, block_time)
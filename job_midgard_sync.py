@@ -1,68 +1,158 @@
-import re
 from typing import Optional
 
-from aiohttp import ClientSession
-
 from alerts import AlertSender
+from http_client import HttpClient
 from job import AbstractJob
-from utils import normalize_url
-
-# Regular expression pattern to extract progress
-RE_PROGRESS_PATTERN = r"progress=(\d+\.\d+)%"
+from series import TimeSeries
+from utils import normalize_url, now_ts, format_timedelta, HOUR, MINUTE
 
 
 class JobMidgardSync(AbstractJob):
-    def __init__(self, alert: AlertSender, session: Optional[ClientSession] = None,
+    # one sample a minute for 12 hours: older history doesn't tell much about the current rate
+    SAMPLE_INTERVAL = MINUTE
+    SAMPLE_CAPACITY = 720
+
+    RATE_WINDOW = 30 * MINUTE  # the "current" rate
+    AVERAGE_WINDOW = 6 * HOUR  # the "recent average" rate
+    MIN_RATE_SPAN = 5 * MINUTE  # don't judge the rate on less history than that
+    SLOWDOWN_RATIO = 0.5
+    FINISH_SOON = HOUR  # poll at the base period when the sync is about to end
+
+    def __init__(self, alert: AlertSender, client: Optional[HttpClient] = None,
                  period: float = 10.0,
-                 target_url: str = '', progress_step: float = 1.0):
-        super().__init__(alert, period, session)
+                 target_url: str = '', progress_step: float = 1.0, job_id=None):
+        super().__init__(alert, period, client, job_id)
         self.target_url = self.fix_url(target_url)
         self.prev_progress = 0.0
         self.progress_step = progress_step
+        self.samples = TimeSeries(self.SAMPLE_CAPACITY, self.SAMPLE_INTERVAL)
+        self.progress_seq = None
+        self.progress_ts = None  # time of the log line of the last sample
+
+    def get_state(self):
+        return {
+            'prev_progress': self.prev_progress,
+            'progress_seq': self.progress_seq,
+            'progress_ts': self.progress_ts,
+            'samples': self.samples.to_list(),
+        }
+
+    def set_state(self, state: dict):
+        self.prev_progress = float(state.get('prev_progress', 0.0))
+        self.progress_seq = state.get('progress_seq')
+        self.progress_ts = state.get('progress_ts')
+        self.samples.load(state.get('samples', []))
 
     async def tick(self):
-        logs = await self.get_logs()
-        if logs is None:
+        progress, seq, ts = await self.get_progress()
+        if progress is None:
+            self.report(None, 'no progress yet')
             return
+        self.report(None, f"{progress}%")
 
-        # find the last log line with progress
-        progress = None
-        for log_line in reversed(logs):
-            progress = self._get_progress(log_line)
-            if progress is not None:
-                break
+        # an agent that restarted gives old lines again under new sequence numbers, their time tells
+        replayed = ts is not None and self.progress_ts is not None and ts <= self.progress_ts
+        if (seq is not None and seq == self.progress_seq) or replayed:
+            # no new progress line in the logs: nothing to sample (Midgard may well be in sync already)
+            if progress < 100.0:
+                await self.check_silence(progress, ts)
+            return
+        self.progress_seq = seq
+        self.progress_ts = ts
 
-        if progress is not None:
-            self.logger.info(f"Progress: {progress}%")
-            if progress >= 100.0:
+        if progress < self.prev_progress - self.progress_step:
+            self.logger.warning(f"Progress went back from {self.prev_progress}% to {progress}%. Resync?")
+            self.prev_progress = 0.0
+            self.samples.clear()
+
+        self.samples.append(now_ts(), progress)
+        rate, average_rate = self.rate_per_hour(self.RATE_WINDOW), self.rate_per_hour(self.AVERAGE_WINDOW)
+
+        self.logger.info("Progress: %s%%, rate: %s %%/h (average %s %%/h)", progress, rate, average_rate)
+        if progress >= 100.0:
+            if self.prev_progress < 100.0:
+                self.prev_progress = progress
                 self.logger.info("Finished!")
                 text = f"🆗 [Midgard] Sync completed!"
-                await self.alert.send(text)
-            else:
-                if progress - self.prev_progress >= self.progress_step:
-                    self.prev_progress = progress
-                    text = f"🚥 [Midgard] Sync progress: {progress}%"
-                    await self.alert.send(text)
-
-    async def get_logs(self):
-        # load logs from the target URL
-        async with self.session.get(self.target_url) as resp:
-            if resp.status != 200:
-                self.logger.error(f"Failed to get logs: {resp.status}")
-                return
-
-            # json logs
-            logs = await resp.json()
-            messages = [log.get('message', '') for log in logs['logs']]
-            return messages
+                await self.alert.send(text, job=self.name)
+            await self.clear_alert('stall')
+            return
+
+        if progress - self.prev_progress >= self.progress_step:
+            self.prev_progress = progress
+            text = f"🚥 [Midgard] Sync progress: {progress}%{self.describe_rate(progress, rate)}"
+            await self.alert.send(text, job=self.name)
+
+        await self.check_rate(progress, rate, average_rate)
+
+        eta = self.eta(progress, rate)
+        if eta is not None and eta < self.FINISH_SOON:
+            self.mark_urgent('sync')
+
+    def rate_per_hour(self, window) -> Optional[float]:
+        slope = self.samples.slope(window, min_span=self.MIN_RATE_SPAN)
+        return slope * HOUR if slope is not None else None
 
     @staticmethod
-    def fix_url(url: str):
-        return normalize_url(url, '/logs')
+    def eta(progress, rate):
+        if not rate or rate <= 0:
+            return None
+        return (100.0 - progress) / rate * HOUR
+
+    def describe_eta(self, progress, rate):
+        eta = self.eta(progress, rate)
+        return f"ETA {format_timedelta(eta)}" if eta is not None else 'no ETA'
+
+    def describe_rate(self, progress, rate):
+        if rate is None:
+            return ''
+        return f" ({rate:.2f} %/h, {self.describe_eta(progress, rate)})"
+
+    async def check_rate(self, progress, rate, average_rate):
+        if rate is None:
+            return
+
+        if rate <= 0.0:
+            await self.raise_alert('stall', f"🚨 [Midgard] Sync is stalled at {progress}% "
+                                            f"for {format_timedelta(self.samples.span(self.RATE_WINDOW))}!")
+            return
+        await self.clear_alert('stall')
+
+        if average_rate and rate < average_rate * self.SLOWDOWN_RATIO:
+            await self.raise_alert('slowdown', f"🐢 [Midgard] Sync slowed down to {rate:.2f} %/h "
+                                               f"(recent average {average_rate:.2f} %/h), "
+                                               f"{self.describe_eta(progress, rate)}")
+        else:
+            await self.clear_alert('slowdown')
+
+    async def check_silence(self, progress, ts):
+        """
+        A hung Midgard writes no progress lines at all, so there are no samples to compute the rate from:
+        the age of the last line tells instead.
+        """
+        if self.progress_ts is not None:
+            ts = max(ts or 0.0, self.progress_ts)
+        if ts is None:
+            return
+        age = now_ts() - ts
+        if age >= self.RATE_WINDOW:
+            await self.raise_alert('stall', f"🚨 [Midgard] Sync is stalled at {progress}%: "
+                                            f"no progress in the logs for {format_timedelta(age)}!")
+
+    async def get_progress(self):
+        """
+        Returns (progress, sequence number of the log line it came from, its time).
+        The agent extracts the latest progress from the logs itself, we only get the number.
+        """
+        data = await self.get_url_contents(self.target_url)
+        if data.get('error'):
+            self.logger.error(f"Agent error: {data['error']}")
+        progress = data.get('progress')
+        if progress is None:
+            return None, None, None
+        metric = (data.get('metrics') or {}).get('progress') or {}
+        return float(progress), metric.get('seq'), metric.get('ts')
 
     @staticmethod
-    def _get_progress(log_line):
-        match = re.search(RE_PROGRESS_PATTERN, log_line)
-        if match:
-            progress = float(match.group(1))
-            return progress
+    def fix_url(url: str):
+        return normalize_url(url, '/progress')
@@ -1,60 +1,140 @@
-import aiohttp
+from urllib import parse
 
 from alerts import AlertSender
-from job import AbstractJob
+from block_stream import BlockStream
+from height_history import HeightHistory
+from http_client import HttpClient
+from job import DEFAULT_CONCURRENCY, PairedFetch
+from job_height import HeightJob
+from node import Node
+from reference import ReferencePool, median_by
 from utils import normalize_url
 
-BLOCK_TIME = 6
 
+class JobThorNodeHeight(HeightJob):
+    TAG = 'THOR'
+    DIFF_NAME = 'Block number diff'
 
-class JobThorNodeHeight(AbstractJob):
-    def __init__(self, alert: AlertSender, session, test_url, ref_url, period=10.0, diff_alert_threshold=10):
-        super().__init__(alert, period, session)
-        self.session = session or aiohttp.ClientSession()
-        self.test_url = self.fix_url(test_url)
-        self.ref_url = self.fix_url(ref_url)
+    def __init__(self, alert: AlertSender, client: HttpClient, test_url, ref_url, period=10.0, diff_alert_threshold=10,
+                 concurrency=DEFAULT_CONCURRENCY, trend_alert_rate=1.0, reference_options=None,
+                 rpc_ws_port=None, stall_blocks=5, job_id=None):
+        super().__init__(alert, period, client, job_id)
+        self.nodes = Node.parse_list(test_url, self.fix_url)
+        if not self.nodes:
+            raise ValueError('No test nodes configured')
+        self.references = ReferencePool(
+            Node.parse_list(ref_url, self.fix_url), self.read_block_number, median_by(int),
+            name=self.name, **(reference_options or {}),
+        )
+        self.reference_urls.update(self.references.urls)
         self.diff_alert_threshold = diff_alert_threshold
+        self.concurrency = concurrency
+        self.trend_alert_rate = trend_alert_rate  # blocks/min
+        self.history = HeightHistory()
+
+        # push mode: new blocks come over the Tendermint RPC websocket, polling is only the fallback
+        self.rpc_ws_port = rpc_ws_port
+        self.stall_blocks = stall_blocks
+        self.streams = {}  # node name -> BlockStream
 
     @staticmethod
     def fix_url(url: str):
         return normalize_url(url, '/thorchain/lastblock')
 
-    async def retrieve_block_number(self, url):
-        try:
-            async with self.session.get(url) as resp:
-                data = await resp.json()
-                if resp.status != 200:
-                    raise Exception(f'Status is not OK ({resp.status}))')
-                if isinstance(data, str):
-                    raise Exception(f'Unexpected text ({data})')
-                return int(data[0]['thorchain'])
+    def ws_url(self, node: Node):
+        parsed = parse.urlparse(node.url)
+        scheme = 'wss' if parsed.scheme == 'https' else 'ws'
+        host = parsed.hostname or ''
+        if ':' in host:  # IPv6
+            host = f'[{host}]'
+        userinfo, at, _ = parsed.netloc.rpartition('@')
+        netloc = f"{userinfo}{at}{host}:{self.rpc_ws_port}"
+        return parse.urlunparse(parsed._replace(scheme=scheme, netloc=netloc, path='/websocket',
+                                                params='', query='', fragment=''))
 
-        except Exception as e:
-            text = f"🚨 [THOR] Error loading URL {self.test_url}: {type(e).__name__}"
-            self.logger.exception(text)
-            await self.alert.send(text)
+    def stall_timeout(self):
+        return self.stall_blocks * self.history.block_time
 
-    async def compare_block_numbers(self):
-        block_number_test = await self.retrieve_block_number(self.test_url)
-        if block_number_test is None:
+    def start_streams(self):
+        if not self.rpc_ws_port or self.streams:
             return
+        for node in self.nodes:
+            stream = self.streams[node.name] = BlockStream(
+                self.client.session, self.ws_url(node), node.name,
+                stall_timeout=self.stall_timeout,
+                on_stall=lambda s, node=node: self.on_stall(node, s),
+            )
+            stream.start()
 
-        block_number_ref = await self.retrieve_block_number(self.ref_url)
-        if block_number_ref is None:
-            return
+    async def close(self):
+        for stream in self.streams.values():
+            await stream.stop()
+        self.streams.clear()
+
+    @staticmethod
+    def stall_text(node: Node, stream: BlockStream):
+        return f"🛑 [THOR] {node.label}: No new block for {stream.stall_timeout():.0f} sec (last #{stream.height})!"
+
+    async def on_stall(self, node: Node, stream: BlockStream):
+        # called by the stream between ticks: the alert goes out at once, the next tick takes the stall over
+        await self.alert.suppressor.fire(self.alert_key('stall', node), self.stall_text(node, stream))
 
-        delta = abs(block_number_test - block_number_ref)
-        time_delta = delta * BLOCK_TIME
+    async def check_streams(self):
+        """
+        The stalls the streams have detected become part of the tick: its status and adaptive polling.
+        """
+        for node in self.nodes:
+            stream = self.streams.get(node.name)
+            if stream is None:
+                continue
+            if stream.stalled:
+                await self.raise_alert('stall', self.stall_text(node, stream), node)
+                self.report(node, f"no new block after #{stream.height}", ok=False)
+            else:
+                await self.clear_alert('stall', node, f"✅ [THOR] {node.label}: New blocks again (#{stream.height}).")
 
-        self.logger.info(
-            f"Block number diff: {delta} (ref = {block_number_ref} vs test = {block_number_test}) "
-            f"≈{time_delta} sec"
+    async def node_height(self, node: Node):
+        stream = self.streams.get(node.name)
+        if stream is not None and stream.fresh(self.stall_timeout()):
+            # the node hasn't announced a newer block, so this is its height right now
+            await self.clear_alert('fetch', node)
+            return stream.height
+        return await self.retrieve_block_number(node.url, node)
+
+    async def read_block_number(self, url):
+        data = await self.get_url_contents(url)
+        return int(data[0]['thorchain'])
+
+    async def retrieve_block_number(self, url, node: Node):
+        try:
+            height = await self.read_block_number(url)
+
+        except Exception as e:
+            text = f"🚨 [THOR] Error loading URL {node.label} ({url}): {type(e).__name__}"
+            self.logger.exception(text)
+            await self.raise_alert('fetch', text, node)
+
+        else:
+            await self.clear_alert('fetch', node)
+            return height
+
+    async def compare_block_numbers(self):
+        results = await self.fetch_fleet(
+            self.nodes,
+            self.node_height,
+            self.query_references('THOR'),
         )
+        ref_rate, block_time = self.track_reference(results[0][1].ref)
+        for node, pair in results:
+            await self.compare_node(node, pair, ref_rate, block_time)
 
-        if abs(block_number_test - block_number_ref) >= self.diff_alert_threshold:
-            text = (f"🚨 [THOR] Block number diff is more than {self.diff_alert_threshold} "
-                    f"<b>({delta} blocks, {time_delta} seconds)</b>!")
-            await self.alert.send(text)
+    async def compare_node(self, node: Node, pair: PairedFetch, ref_rate, block_time):
+        if not pair.ok:
+            self.report(node, 'no data' if not pair.test.ok else 'no reference', ok=False)
+            return
+        await self.check_heights(node, pair, ref_rate, block_time)
 
     async def tick(self):
+        self.start_streams()
         await self.compare_block_numbers()
+        await self.check_streams()
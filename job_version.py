@@ -1,60 +1,96 @@
-import aiohttp
-import semver
+from functools import lru_cache
 
 from alerts import AlertSender
-from job import AbstractJob
+from http_client import HttpClient
+from job import AbstractJob, DEFAULT_CONCURRENCY, PairedFetch
+from node import Node
+from reference import ReferencePool, majority_by
 from utils import normalize_url
 
-BLOCK_TIME = 6
+
+@lru_cache(maxsize=256)
+def parse_version(v: str):
+    # a fleet mostly reports the same couple of versions, no need to parse them on every tick
+    import semver  # lazily: the one-shot check must start fast
+    return semver.VersionInfo.parse(v)
 
 
 class JobThorNodeVersion(AbstractJob):
-    def __init__(self, alert: AlertSender, session, test_url, ref_url, period=10.0):
-        super().__init__(alert, period, session)
-        self.session = session or aiohttp.ClientSession()
-        self.test_url = self.fix_url(test_url)
-        self.ref_url = self.fix_url(ref_url)
-        self.last_signalled_version = None
+    def __init__(self, alert: AlertSender, client: HttpClient, test_url, ref_url, period=10.0,
+                 concurrency=DEFAULT_CONCURRENCY, reference_options=None, job_id=None):
+        super().__init__(alert, period, client, job_id)
+        self.nodes = Node.parse_list(test_url, self.fix_url)
+        if not self.nodes:
+            raise ValueError('No test nodes configured')
+        self.references = ReferencePool(
+            Node.parse_list(ref_url, self.fix_url), self.get_url_contents, majority_by(lambda v: v['querier']),
+            name=self.name, **(reference_options or {}),
+        )
+        self.reference_urls.update(self.references.urls)
+        self.concurrency = concurrency
+        self.last_signalled_version = {}  # node name -> ref version
 
     @staticmethod
     def fix_url(url: str):
         return normalize_url(url, '/thorchain/version')
 
-    async def retrieve_version(self, url):
+    def get_state(self):
+        return {'last_signalled_version': {name: str(v) for name, v in self.last_signalled_version.items()}}
+
+    def set_state(self, state: dict):
+        self.last_signalled_version = {
+            name: parse_version(v) for name, v in state.get('last_signalled_version', {}).items()
+        }
+
+    async def retrieve_version(self, url, node: Node):
         try:
-            async with self.session.get(url) as resp:
-                data = await resp.json()
-                if resp.status != 200:
-                    raise Exception(f'Status is not OK ({resp.status}))')
-                if isinstance(data, str):
-                    raise Exception(f'Unexpected text ({data})')
-                return data
+            version = await self.get_url_contents(url)
 
         except Exception as e:
-            text = f"🚨 [THOR] Error loading URL {self.test_url}: {type(e).__name__}"
+            text = f"🚨 [THOR] Error loading URL {node.label} ({url}): {type(e).__name__}"
             self.logger.exception(text)
-            await self.alert.send(text)
+            await self.raise_alert('fetch', text, node)
+
+        else:
+            await self.clear_alert('fetch', node)
+            return version
 
     async def compare_versions(self):
-        test_v = await self.retrieve_version(self.test_url)
-        if test_v is None:
-            return
+        results = await self.fetch_fleet(
+            self.nodes,
+            lambda node: self.retrieve_version(node.url, node),
+            self.query_references('THOR'),
+        )
+        for node, pair in results:
+            await self.compare_node(node, pair)
 
-        ref_v = await self.retrieve_version(self.ref_url)
-        if ref_v is None:
+    async def compare_node(self, node: Node, pair: PairedFetch):
+        if not pair.ok:
+            self.report(node, 'no data' if not pair.test.ok else 'no reference', ok=False)
             return
 
-        self.logger.info(f"Test version: {test_v} vs Ref version: {ref_v}")
+        test_v, ref_v = pair.test.value, pair.ref.value
+
+        self.logger.info("[%s] Test version: %s vs Ref version: %s", node.name, test_v, ref_v)
 
-        my_version = semver.VersionInfo.parse(test_v['querier'])
-        ref_version = semver.VersionInfo.parse(ref_v['querier'])
+        my_version = parse_version(test_v['querier'])
+        ref_version = parse_version(ref_v['querier'])
+        if my_version == ref_version:
+            self.report(node, str(my_version))
+        else:
+            self.report(node, f"{my_version}, ref is {ref_version}", ok=False)
 
         if my_version != ref_version:
-            if self.last_signalled_version != ref_version:
-                self.last_signalled_version = ref_version
-                text = (f"⬆️ [THOR] Our version (<b>{my_version})</b> "
+            if self.last_signalled_version.get(node.name) != ref_version:
+                self.last_signalled_version[node.name] = ref_version
+                text = (f"⬆️ [THOR] {node.label}: Our version (<b>{my_version})</b> "
                         f"is different from the reference one (<b>{ref_version})</b>!")
-                await self.alert.send(text)
+                # a new reference version is news by itself, don't let the old one's cooldown hold it
+                self.alert.suppressor.forget(self.alert_key('version', node))
+                await self.raise_alert('version', text, node)
+        else:
+            self.last_signalled_version.pop(node.name, None)
+            await self.clear_alert('version', node, f"✅ [THOR] {node.label}: Version is up to date ({my_version}).")
 
     async def tick(self):
         await self.compare_versions()
@@ -6,21 +6,39 @@ from utils import format_timedelta
 
 
 class JobWatchdog(AbstractJob):
-    def __init__(self, alert, period, alert_period_sec):
-        super().__init__(alert, period)
+    adaptive = False  # a heartbeat must keep its pace
+    one_shot = False  # nothing to check
+
+    def __init__(self, alert, period, alert_period_sec, job_id=None):
+        super().__init__(alert, period, job_id=job_id)
         self.alert_period_sec = alert_period_sec
         self.start_ts = datetime.utcnow()
+        self.first_start_ts = self.start_ts  # survives restarts
         self.fire_ts = self.start_ts
         self.cd = Cooldown(self.name, self.alert_period_sec)
         self.logger.info(f'Configured watchdog with period {self.alert_period_sec} sec.')
 
+    def get_state(self):
+        return {
+            'first_start_ts': self.first_start_ts.timestamp(),
+            'cooldown': self.cd.to_dict(),
+        }
+
+    def set_state(self, state: dict):
+        if state.get('first_start_ts'):
+            self.first_start_ts = datetime.fromtimestamp(state['first_start_ts'])
+        self.cd.load(state.get('cooldown', {}))
+
     async def tick(self):
         if self.cd.ready:
-            elapsed_formatted = format_timedelta(datetime.utcnow() - self.start_ts)
+            now = datetime.utcnow()
+            elapsed_formatted = format_timedelta(now - self.start_ts)
             period_formatted = format_timedelta(self.alert_period_sec)
-            await self.alert.send(
-                f"👀 Still watching... #{self.tick_no}.\n"
-                f"Elapsed since last restart: {elapsed_formatted}.\n"
-                f"I will send you just message every {period_formatted}.")
+            text = f"👀 Still watching... #{self.tick_no}.\n"
+            if self.first_start_ts < self.start_ts:
+                text += f"Watching for {format_timedelta(now - self.first_start_ts)}.\n"
+            text += (f"Elapsed since last restart: {elapsed_formatted}.\n"
+                     f"I will send you just message every {period_formatted}.")
+            await self.alert.send(text, job=self.name)
 
             self.cd.do()
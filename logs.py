@@ -1,12 +1,16 @@
 import asyncio
+import atexit
 import logging
 import os
+import queue
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
 
-from colorama import init, Fore
+import codec
 
-init(autoreset=True)
 g_log_level = logging.INFO
+g_listener = None
 
 
 class WithLogger:
@@ -20,23 +24,98 @@ class WithLogger:
 
 
 class ColorFormatter(logging.Formatter):
-    # Change this dictionary to suit your coloring needs!
+    # Change this dictionary to suit your coloring needs! (names of colorama.Fore colors)
     COLORS = {
-        "WARNING": Fore.YELLOW,
-        "ERROR": Fore.RED,
-        "DEBUG": Fore.BLUE,
-        "INFO": Fore.GREEN,
-        "CRITICAL": Fore.RED
+        "WARNING": "YELLOW",
+        "ERROR": "RED",
+        "DEBUG": "BLUE",
+        "INFO": "GREEN",
+        "CRITICAL": "RED"
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # imported here, so that the one-shot check doesn't pay for it unless it logs in color
+        from colorama import init, Fore
+        init(autoreset=True)
+        self.colors = {level: getattr(Fore, name) for level, name in self.COLORS.items()}
+        self.reset = Fore.RESET
+
     def format(self, record):
-        color = self.COLORS.get(record.levelname, "")
+        color = self.colors.get(record.levelname, "")
         message = logging.Formatter.format(self, record)
         if color:
-            message = color + message + Fore.RESET
+            message = color + message + self.reset
         return message
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, for log collectors.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'func': record.funcName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return codec.dumps_str(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `rate` records of one message template per `interval` seconds through: the per-tick lines
+    of big fleets are sampled instead of flooding the log. Warnings and errors always pass.
+    The first record after a window with drops tells how many similar ones were dropped.
+    Works best with %-style arguments, as the template is the key.
+    """
+
+    def __init__(self, rate: int, interval=60.0, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        self.max_level = max_level
+        self.windows = {}  # (logger, template) -> [window start, passed, dropped]
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            dropped = window[2] if window else 0
+            if len(self.windows) > 10_000:
+                self.windows.clear()
+            self.windows[key] = [now, 1, 0]
+            if dropped:
+                record.msg = f'{record.msg} (+{dropped} similar dropped)'
+            return True
+
+        if window[1] < self.rate:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.dropped += 1
+        return False
+
+
+class ThreadQueueHandler(QueueHandler):
+    """
+    Only puts the record to the queue: the message is formatted by the listener thread, not the event loop.
+    """
+
+    def prepare(self, record):
+        return record
+
+
 def class_logger(self, prefix=''):
     # global g_log_level
     # return logging.getLogger()
@@ -46,18 +125,37 @@ def class_logger(self, prefix=''):
     return logger
 
 
-def setup_logs(log_level, is_std_out=True, colorful=True):
-    global g_log_level
+def setup_logs(log_level, is_std_out=True, colorful=True, json_format=False, queued=True, rate_limit=0,
+               rate_interval=60.0):
+    """
+    queued: records are formatted and written by a background thread, the caller only puts them to a queue.
+    rate_limit: at most this many info/debug records of one message per rate_interval seconds (0 for all).
+    """
+    global g_log_level, g_listener
     g_log_level = logging.getLevelName(log_level)
+    stop_logs()
 
     stream = sys.stdout if is_std_out else sys.stderr
     handler = logging.StreamHandler(stream)
-    formatter = ColorFormatter if colorful else logging.Formatter
+    if json_format:
+        formatter = JsonFormatter
+    else:
+        formatter = ColorFormatter if colorful else logging.Formatter
     handler.setFormatter(formatter(
         '[%(levelname)s] | %(asctime)s | %(name)s | %(funcName)s | "%(message)s"',
         datefmt='%Y-%m-%d %H:%M:%S',
     ))
 
+    if queued:
+        records = queue.SimpleQueue()
+        g_listener = QueueListener(records, handler, respect_handler_level=True)
+        g_listener.start()
+        handler = ThreadQueueHandler(records)
+
+    if rate_limit:
+        # on the handler the caller runs, so dropped records cost no formatting at all
+        handler.addFilter(RateLimitFilter(rate_limit, rate_interval))
+
     logging.basicConfig(
         level=g_log_level,
         handlers=[handler],
@@ -65,6 +163,17 @@ def setup_logs(log_level, is_std_out=True, colorful=True):
     )
 
 
+@atexit.register
+def stop_logs():
+    """
+    Writes out what is still queued.
+    """
+    global g_listener
+    if g_listener is not None:
+        g_listener.stop()
+        g_listener = None
+
+
 async def say(msg: str):
     if not msg:
         return
@@ -1,88 +1,379 @@
+import argparse
 import asyncio
 import logging
 import os
+import sys
 from contextlib import suppress
 
-import aiohttp
-from dotenv import load_dotenv
-
-from alerts import AlertSender
-from job_midgard_height import JobMidgardHealth
-from job_midgard_sync import JobMidgardSync
-from job_thornode_height import JobThorNodeHeight
-from job_version import JobThorNodeVersion
-from job_watchdog import JobWatchdog
+import config
+import metrics
+import status
+from alerts import AlertSender, TELEGRAM_API_URL
+from cache import ResponseCache
+from http_client import HttpClient, EndpointPolicy
 from logs import WithLogger, setup_logs
+from profiling import make_trace_config, setup_profiling
+from routing import ANY, Router, parse_routes
+from scheduler import Scheduler
+from state import StateStore
 from utils import parse_timespan_to_seconds
 
 
 class Main(WithLogger):
-    def __init__(self):
+    def __init__(self, one_shot=False, telegram=True):
         super().__init__()
-        self.admin_id = int(os.environ['TG_ADMIN_USER'])
-        self.bot_token = os.environ['TG_BOT_TOKEN']
+        self.one_shot = one_shot
+        self.telegram = telegram
+        if telegram:
+            self.admin_id = int(os.environ['TG_ADMIN_USER'])
+            self.bot_token = os.environ['TG_BOT_TOKEN']
+        else:
+            self.admin_id = int(os.environ.get('TG_ADMIN_USER') or 0)
+            self.bot_token = os.environ.get('TG_BOT_TOKEN', '')
+
+        # how many nodes of one fleet job are queried at the same time
+        self.concurrency = int(os.environ.get('FLEET_CONCURRENCY', 50))
+
+        self.cache = ResponseCache(ttl=float(os.environ.get('HTTP_CACHE_TTL', 2.0)))
+
+        default_policy = EndpointPolicy(
+            connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.0)),
+            read_timeout=float(os.environ.get('HTTP_READ_TIMEOUT', 5.0)),
+            total_timeout=float(os.environ.get('HTTP_TOTAL_TIMEOUT', 15.0)),
+            retries=int(os.environ.get('HTTP_RETRIES', 2)),
+        )
+        s = self.client = HttpClient(
+            default_policy,
+            HttpClient.parse_policies(os.environ.get('HTTP_ENDPOINT_TIMEOUTS', ''), default_policy),
+            cache=self.cache,
+            limit=self.concurrency * 2,
+            limit_per_host=int(os.environ.get('HTTP_LIMIT_PER_HOST', 10)),
+            trace_configs=[make_trace_config()],
+        )
+        # jobs and alert routes may be described by a config file, watched and applied live
+        self.config_file = os.environ.get('CONFIG_FILE', '')
+        cfg = config.load_config(self.config_file) if self.config_file else None
+        # job[/severity[/node]]=chat1,chat2 or =mute, separated by semicolons; the rest goes to TG_ADMIN_USER
+        self.env_routes = parse_routes(os.environ.get('ALERT_ROUTES', ''))
 
-        s = self.session = aiohttp.ClientSession()
-        a = self.alert = AlertSender(self.session, self.bot_token, self.admin_id)
+        a = self.alert = AlertSender(
+            self.client.session, self.bot_token, self.admin_id,
+            api_url=os.environ.get('TELEGRAM_API_URL') or TELEGRAM_API_URL,
+            # the one-shot check has queued everything by the time it sends
+            batch_window=0.0 if one_shot else float(os.environ.get('ALERT_BATCH_WINDOW', 2.0)),
+            repeat_cooldown=parse_timespan_to_seconds(os.environ.get('ALERT_REPEAT_COOLDOWN', '1m')),
+            max_repeat_cooldown=parse_timespan_to_seconds(os.environ.get('ALERT_REPEAT_MAX_COOLDOWN', '6h')),
+            dry_run=not telegram,
+            router=self.make_router(cfg),
+        )
 
         self.period = float(os.environ.get('TICK_PERIOD', 10))
         self.logger.info(f'Tick period is set to {self.period} sec.')
 
+        self.scheduler = Scheduler(
+            start_jitter=float(os.environ.get('SCHEDULER_START_JITTER', 1.0)),
+            tick_jitter=float(os.environ.get('SCHEDULER_TICK_JITTER', 0.0)),
+        )
+
+        specs = cfg.jobs if cfg else self.specs_from_env()
+        self.specs = {spec.id: spec for spec in specs}
+        self.job_by_id = {spec.id: config.build_job(spec, a, s, one_shot) for spec in specs}
+        self.check_routes()
+
+        self.config_watcher = None
+        if self.config_file and not one_shot:
+            self.config_watcher = config.ConfigWatcher(
+                self.config_file, self.apply_config,
+                interval=parse_timespan_to_seconds(os.environ.get('CONFIG_RELOAD_PERIOD', '5s')),
+            )
+
+        self.state = StateStore(
+            os.environ.get('STATE_FILE', 'state.json'),
+            flush_interval=parse_timespan_to_seconds(os.environ.get('STATE_FLUSH_PERIOD', '10s')),
+        )
+
+        # bot commands (/status, /lag, ...) are answered from the last tick of every job
+        self.commands = None
+        if telegram and not one_shot and os.environ.get('TG_COMMANDS', '1').lower() in ('1', 'true', 'yes'):
+            from commands import CommandHandler
+            self.commands = CommandHandler(
+                self.alert, lambda: self.jobs,
+                allowed_chats=self.command_chats(),
+                poll_timeout=int(os.environ.get('TG_COMMANDS_POLL_TIMEOUT', 30)),
+            )
+
+        self.status_server = None
+        metrics_port = int(os.environ.get('METRICS_PORT', 8000))
+        if metrics_port and not one_shot:
+            from web_server import StatusServer  # aiohttp.web is not needed for the one-shot check
+            self.status_server = StatusServer(
+                self.scheduler, self.alert, self.cache,
+                port=metrics_port,
+                max_missed_deadlines=int(os.environ.get('HEALTHZ_MAX_MISSED_DEADLINES', 3)),
+            )
+
+    @property
+    def jobs(self):
+        return list(self.job_by_id.values())
+
+    def job_period(self, env_name):
+        return float(parse_timespan_to_seconds(os.environ.get(env_name, str(self.period))))
+
+    def specs_from_env(self):
+        # every *_REF_URL may list several references: the consensus of the fastest of them is used
+        reference_options = dict(
+            quorum=int(os.environ.get('REF_QUORUM', 2)),
+            hedge_percentile=float(os.environ.get('REF_HEDGE_PERCENTILE', 90)) / 100,
+            deadline=float(os.environ.get('REF_DEADLINE', 5.0)),
+        )
+
+        # adaptive polling: calm jobs slow down up to this period, anything suspicious brings them back
+        adaptive = None
+        adaptive_max_period = parse_timespan_to_seconds(os.environ.get('ADAPTIVE_MAX_PERIOD') or '0')
+        if adaptive_max_period:
+            adaptive = dict(
+                max_period=adaptive_max_period,
+                calm_ticks=int(os.environ.get('ADAPTIVE_CALM_TICKS', 3)),
+                growth=float(os.environ.get('ADAPTIVE_GROWTH', 1.5)),
+            )
+
         ref_thornode = os.environ['THORNODE_REF_URL']
         test_thornode = os.environ['THORNODE_TEST_URL']
 
-        # jobs are
-        self.jobs = [
-            JobThorNodeHeight(
-                a, s,
+        # ids are the class names, as the saved state of the jobs is keyed by them
+        return [
+            config.JobSpec('JobThorNodeHeight', 'thor_height', dict(
                 ref_url=ref_thornode,
                 test_url=test_thornode,
-                period=self.period,
-                diff_alert_threshold=int(os.environ.get('THOR_BLOCK_DIFF_TO_ALERT', 10))
-            ),
-            JobMidgardHealth(
-                a, s,
+                period=self.job_period('THOR_HEIGHT_PERIOD'),
+                diff_alert_threshold=int(os.environ.get('THOR_BLOCK_DIFF_TO_ALERT', 10)),
+                trend_alert_rate=float(os.environ.get('THOR_LAG_TREND_TO_ALERT', 1.0)),
+                concurrency=self.concurrency,
+                reference_options=reference_options,
+                rpc_ws_port=os.environ.get('THOR_RPC_WS_PORT') or None,
+                stall_blocks=float(os.environ.get('THOR_STALL_BLOCKS', 5)),
+            ), adaptive),
+            config.JobSpec('JobMidgardHealth', 'midgard_health', dict(
                 ref_url=os.environ['MIDGARD_HEALTH_REF_URL'],
                 test_url=os.environ['MIDGARD_HEALTH_TEST_URL'],
-                period=self.period,
+                period=self.job_period('MIDGARD_HEALTH_PERIOD'),
                 diff_alert_threshold=int(os.environ.get('MIDGARD_BLOCK_DIFF_TO_ALERT', 10)),
-            ),
-            JobWatchdog(
-                a,
-                self.period,
-                alert_period_sec=parse_timespan_to_seconds(os.environ.get('WATCH_DOG_PERIOD', '5m'))
-            ),
-            JobThorNodeVersion(
-                a, s,
+                trend_alert_rate=float(os.environ.get('MIDGARD_LAG_TREND_TO_ALERT', 1.0)),
+                concurrency=self.concurrency,
+                reference_options=reference_options,
+            ), adaptive),
+            config.JobSpec('JobWatchdog', 'watchdog', dict(
+                period=self.job_period('WATCH_DOG_TICK_PERIOD'),
+                alert_period_sec=parse_timespan_to_seconds(os.environ.get('WATCH_DOG_PERIOD', '5m')),
+            )),
+            config.JobSpec('JobThorNodeVersion', 'thor_version', dict(
                 ref_url=ref_thornode,
                 test_url=test_thornode,
-                period=self.period
-            ),
-            JobMidgardSync(
-                a, s,
-                period=self.period,
+                period=self.job_period('THOR_VERSION_PERIOD'),
+                concurrency=self.concurrency,
+                reference_options=reference_options,
+            ), adaptive),
+            config.JobSpec('JobMidgardSync', 'midgard_sync', dict(
+                period=self.job_period('MIDGARD_SYNC_PERIOD'),
                 target_url=os.environ['MIDGARD_SYNC_STATUS_URL'],
-                progress_step=float(os.environ.get('MIDGARD_PROGRESS_STEP', 1.0))
-            ),
+                progress_step=float(os.environ.get('MIDGARD_PROGRESS_STEP', 1.0)),
+            ), adaptive),
         ]
 
+    def make_router(self, cfg=None):
+        routes = cfg.routes if cfg and cfg.routes is not None else self.env_routes
+        return Router(routes, [self.admin_id])
+
+    def command_chats(self):
+        chats = os.environ.get('TG_COMMANDS_CHATS', '').replace(',', ' ').split()
+        if chats:
+            return [int(chat) for chat in chats]
+        # everyone who gets the alerts
+        router = self.alert.router
+        return [self.admin_id, *(chat for route in router.routes for chat in route.chats)]
+
+    def check_routes(self):
+        for route in self.alert.router.routes:
+            if route.job != ANY and route.job not in self.job_by_id:
+                self.logger.warning(f"{route} is for an unknown job {route.job!r}")
+
+    async def apply_config(self, cfg):
+        """
+        Brings the running jobs in line with the new specs: removed jobs are stopped, new ones started,
+        changed thresholds and periods applied in place; a job whose nodes or references changed is rebuilt
+        with its state kept. The other jobs, the HTTP client with its cache and the alert queue are not touched.
+        """
+        new_specs = {spec.id: spec for spec in cfg.jobs}
+
+        for job_id in list(self.job_by_id):
+            old, new = self.specs[job_id], new_specs.get(job_id)
+            if new is None:
+                await self.remove_job(job_id)
+                self.logger.info(f"Job {job_id} removed")
+            elif old.retunable(new):
+                job = self.job_by_id[job_id]
+                changes = old.changes(new)
+                if config.retune_job(job, old, new):
+                    self.scheduler.reschedule(job, job.period)
+                self.specs[job_id] = new
+                if changes:
+                    self.logger.info(f"Job {job_id} retuned: {', '.join(sorted(changes))}")
+            else:
+                await self.remove_job(job_id, forget_alerts=False)
+                if self.add_job(new):
+                    self.logger.info(f"Job {job_id} rebuilt")
+                    # alerts of the nodes it still has stay active
+                    job = self.job_by_id[job_id]
+                    self.alert.suppressor.forget_job(job.name, {''} | {node.name for node in job.nodes})
+                else:
+                    self.alert.suppressor.forget_job(job_id)
+
+        for job_id, spec in new_specs.items():
+            if job_id not in self.job_by_id and self.add_job(spec):
+                self.logger.info(f"Job {job_id} added")
+
+        router = self.make_router(cfg)
+        if router.routes != self.alert.router.routes:
+            self.alert.set_router(router)
+            self.check_routes()
+            if self.commands:
+                self.commands.allowed_chats = set(self.command_chats())
+
+    def add_job(self, spec) -> bool:
+        try:
+            job = config.build_job(spec, self.alert, self.client, self.one_shot)
+        except Exception as e:
+            self.logger.error(f"Job {spec.id} is not started: {e!r}")
+            return False
+        self.job_by_id[spec.id] = job
+        self.specs[spec.id] = spec
+        self.state.register(job.state_key, job.get_state, job.set_state)
+        self.scheduler.add(job)
+        return True
+
+    async def remove_job(self, job_id, forget_alerts=True):
+        job = self.job_by_id.pop(job_id)
+        del self.specs[job_id]
+        self.scheduler.remove(job)
+        data = job.get_state()
+        if data is not None:
+            self.state.set(job.state_key, data)  # for the job that replaces it
+        self.state.unregister(job.state_key)
+        await job.close()
+        metrics.REGISTRY.remove(job=job.name)
+        if forget_alerts:
+            self.alert.suppressor.forget_job(job.name)
+
+    def restore_state(self, read_only=False):
+        """
+        read_only: the saved state is only applied and never written back, the file belongs to the resident bot.
+        """
+        self.state.load()
+        suppressor = self.alert.suppressor
+        owners = [('alerts', suppressor.get_state, suppressor.set_state)]
+        owners += [(job.state_key, job.get_state, job.set_state) for job in self.jobs]
+        for key, getter, setter in owners:
+            if read_only:
+                self.state.restore(key, setter)
+            else:
+                self.state.register(key, getter, setter)
+
     async def run(self):
         self.logger.info("Starting main loop")
+        self.restore_state()
+        self.alert.start()
         with suppress(Exception):
             await self.alert.send("🚀 Bot restarted!")
 
-        await asyncio.gather(
-            *[job.run() for job in self.jobs]
-        )
+        for job in self.jobs:
+            self.scheduler.add(job)
+        if self.status_server:
+            await self.status_server.start()
+        try:
+            tasks = [self.scheduler.run(), self.state.run()]
+            if self.config_watcher:
+                tasks.append(self.config_watcher.run())
+            if self.commands:
+                tasks.append(self.commands.run())
+            await asyncio.gather(*tasks)
+        finally:
+            for job in self.jobs:
+                await job.close()
+            await self.state.close()
+            await self.client.close()
+            if self.status_server:
+                await self.status_server.stop()
+
+    async def run_once(self, deadline: float) -> int:
+        """
+        One tick of every job, all at the same time; prints the status table and returns the exit code.
+        Alert suppression state of the resident bot is read (unless Telegram is off), but never written:
+        the two would race for the file.
+        """
+        jobs = [job for job in self.jobs if job.one_shot]
+        if self.telegram:
+            self.restore_state(read_only=True)
+
+        try:
+            tasks = {asyncio.create_task(job.run_tick()): job for job in jobs}
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in pending:
+                tasks[task].status.update(state=status.TIMEOUT, duration=deadline,
+                                          error=f"not done in {deadline:.1f} sec")
+
+            statuses = [job.status for job in jobs]
+            print(status.format_table(statuses))
+
+            if self.telegram:
+                await self.alert.stop()
+            else:
+                for text in self.alert.drain():
+                    print(f"\n{text}")
+            return status.exit_code(statuses)
+        finally:
+            await self.client.close()
 
 
-async def main():
-    setup_logs(logging.INFO)
+def parse_args():
+    parser = argparse.ArgumentParser(description='THORNode and Midgard monitoring bot')
+    parser.add_argument('--once', action='store_true',
+                        help='run every check once, print a status table and exit: '
+                             '0 - all OK, 1 - alerts, 2 - errors or timeouts')
+    parser.add_argument('--deadline', type=float, default=10.0,
+                        help='with --once: overall time limit in seconds (default: 10)')
+    parser.add_argument('--no-telegram', action='store_true',
+                        help='with --once: print the alerts instead of sending them')
+    return parser.parse_args()
+
+
+async def main(args):
+    from dotenv import load_dotenv  # lazily: the one-shot check must start fast
     load_dotenv()
 
+    log_options = dict(
+        json_format=os.environ.get('LOG_FORMAT', 'text').lower() == 'json',
+        queued=os.environ.get('LOG_QUEUE', '1').lower() in ('1', 'true', 'yes'),
+        rate_limit=int(os.environ.get('LOG_RATE_LIMIT', 0)),
+    )
+    if args.once:
+        # stdout is for the table
+        setup_logs(logging.WARNING, is_std_out=False, colorful=sys.stderr.isatty(), **log_options)
+    else:
+        setup_logs(logging.INFO, **log_options)
+    setup_profiling(
+        summary_every=int(os.environ.get('PROFILE_SUMMARY_TICKS', 60)),
+        debug=os.environ.get('PROFILE_DEBUG', '').lower() in ('1', 'true', 'yes'),
+    )
+
+    if args.once:
+        return await Main(one_shot=True, telegram=not args.no_telegram).run_once(args.deadline)
+
     main_obj = Main()
     await main_obj.run()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(asyncio.run(main(parse_args())))
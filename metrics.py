@@ -0,0 +1,174 @@
+"""
+A tiny Prometheus text-format registry; prometheus_client would be one more dependency for a few dozen lines.
+"""
+import bisect
+from typing import Callable, Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Metric:
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def remove(self, **labels):
+        """
+        Drops every series with these label values (a subset of the label names matches more than one).
+        """
+        positions = [(self.labelnames.index(name), str(value))
+                     for name, value in labels.items() if name in self.labelnames]
+        if len(positions) < len(labels):
+            return
+        for key in [key for key in self._values if all(key[i] == value for i, value in positions)]:
+            del self._values[key]
+
+    def clear(self):
+        self._values.clear()
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """
+        For counters that mirror a count kept elsewhere.
+        """
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # per-bucket (non-cumulative) counts, sum, count
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, key, le), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labelnames, key), total
+            yield f'{self.name}_count', _format_labels(self.labelnames, key), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable] = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def remove(self, **labels):
+        """
+        Drops the series with these label values from every metric that has such labels, e.g. remove(job=...).
+        """
+        for metric in self.metrics:
+            metric.remove(**labels)
+
+    def add_collector(self, fn: Callable):
+        """
+        fn() is called before every render to refresh gauges that mirror live values.
+        """
+        self.collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self.collectors:
+            fn()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+TICK_DURATION = REGISTRY.register(Histogram(
+    'thorbot_tick_duration_seconds', 'Duration of job ticks', ('job',)))
+TICK_ERRORS = REGISTRY.register(Counter(
+    'thorbot_tick_errors_total', 'Ticks that ended with an exception', ('job',)))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'thorbot_http_request_duration_seconds', 'Latency of upstream requests', ('upstream',)))
+HTTP_ERRORS = REGISTRY.register(Counter(
+    'thorbot_http_errors_total', 'Failed upstream requests', ('upstream', 'kind')))
+HEIGHT_DIFF = REGISTRY.register(Gauge(
+    'thorbot_height_diff_blocks', 'Last height diff between a node and the reference', ('job', 'node')))
+SCHEDULER_LAG = REGISTRY.register(Gauge(
+    'thorbot_scheduler_lag_seconds', 'How late the last tick of the job started', ('job',)))
+SCHEDULER_OVERRUNS = REGISTRY.register(Counter(
+    'thorbot_scheduler_overruns_total', 'Ticks skipped because the previous one was still running', ('job',)))
+JOB_PERIOD = REGISTRY.register(Gauge(
+    'thorbot_job_period_seconds', 'Current polling period of the job (changes with adaptive polling)', ('job',)))
+JOB_HEALTHY = REGISTRY.register(Gauge(
+    'thorbot_job_healthy', '1 if the job completes its ticks on time', ('job',)))
+ALERT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'thorbot_alert_queue_depth', 'Alerts waiting for delivery to the chat', ('chat',)))
+ALERTS = REGISTRY.register(Counter(
+    'thorbot_alerts_total', 'Alerts by outcome: queued, sent, dropped, failed, suppressed, muted', ('outcome',)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'thorbot_cache_requests_total', 'Response cache lookups: hit, miss, merged', ('result',)))
+REFERENCE_HEDGES = REGISTRY.register(Counter(
+    'thorbot_reference_hedges_total', 'Extra requests sent to spare references when one was slow or failed',
+    ('job',)))
+BLOCK_STREAM_UP = REGISTRY.register(Gauge(
+    'thorbot_block_stream_up', '1 while the websocket subscription to new blocks of the node is connected', ('node',)))
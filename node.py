@@ -0,0 +1,49 @@
+from urllib import parse
+
+
+class Node:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+
+    def __repr__(self):
+        return f'Node({self.name!r}, {self.url!r})'
+
+    @property
+    def label(self):
+        return f'<b>{self.name}</b>'
+
+    @staticmethod
+    def default_name(url: str):
+        if '://' not in url:
+            url = 'https://' + url
+        return parse.urlparse(url).netloc or url
+
+    @classmethod
+    def parse(cls, item: str, fix_url=None):
+        """
+        "name=url" or just "url" (then the name is the host:port part of the URL).
+        """
+        item = item.strip()
+        name, sep, url = item.partition('=')
+        if not sep or '/' in name or ':' in name:
+            name, url = '', item
+        url = url.strip()
+        name = name.strip() or cls.default_name(url)
+        return cls(name, fix_url(url) if fix_url else url)
+
+    @classmethod
+    def parse_list(cls, spec, fix_url=None):
+        """
+        Accepts a single URL, a list of them or a string with items separated by commas, spaces or new lines.
+        """
+        if isinstance(spec, str):
+            spec = spec.replace(',', ' ').split()
+        nodes = [cls.parse(item, fix_url) for item in spec if item.strip()]
+
+        names = set()
+        for node in nodes:
+            if node.name in names:
+                raise ValueError(f'Duplicate node name: {node.name}')
+            names.add(node.name)
+        return nodes
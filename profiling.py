@@ -0,0 +1,173 @@
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import aiohttp
+
+g_summary_every = 60
+g_debug = False
+
+
+def setup_profiling(summary_every=60, debug=False):
+    global g_summary_every, g_debug
+    g_summary_every = max(1, int(summary_every))
+    g_debug = bool(debug)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[k]
+
+
+class TickProfile:
+    """
+    Timing spans of one tick. Phases are named "<side>.<phase>": side is "test", "ref" or "bot",
+    phase is one of queue (waiting for a pooled connection), dns, connect, ttfb (request sent → headers received),
+    body, decode, alert. Concurrent requests each add their own span.
+    """
+
+    def __init__(self, tick_no=0):
+        self.tick_no = tick_no
+        self.started = time.monotonic()
+        self.duration: Optional[float] = None
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+
+    def add(self, phase: str, seconds: float):
+        self.spans[phase].append(seconds)
+
+    @contextmanager
+    def span(self, phase: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, time.monotonic() - started)
+
+    def finish(self):
+        self.duration = time.monotonic() - self.started
+        return self.duration
+
+    def request_ctx(self, side: str):
+        return SimpleNamespace(profile=self, side=side)
+
+    def describe(self, top=5):
+        # the longest single span of every phase approximates the critical path of the tick
+        worst = sorted(((max(v), k) for k, v in self.spans.items() if v), reverse=True)[:top]
+        parts = ', '.join(f'{k} {v:.3f}s' for v, k in worst)
+        return f"tick #{self.tick_no} took {self.duration or 0.0:.3f}s" + (f" ({parts})" if parts else '')
+
+
+class TickProfiler:
+    """
+    Keeps profiles of the recent ticks of one job, detects overruns and slow ticks
+    and produces a periodic summary; in debug mode the summary has per-phase percentiles.
+    """
+
+    def __init__(self, logger, summary_every: int = None, slow_ratio: float = 0.5, debug=None):
+        self.logger = logger
+        self.summary_every = summary_every or g_summary_every
+        self.slow_ratio = slow_ratio
+        self.slow_threshold = 0.0
+        self.debug = g_debug if debug is None else debug
+        self.recent = deque(maxlen=self.summary_every)
+        self.overruns = 0
+        self.slow_ticks = 0
+        self._ticks_since_summary = 0
+
+    def finish(self, profile: TickProfile, period: float):
+        duration = profile.finish()
+        self.recent.append(profile)
+        self.slow_threshold = period * self.slow_ratio
+
+        if duration > period:
+            self.overruns += 1
+            self.logger.warning(f"Overrun: {profile.describe()}, period is {period} sec")
+        elif duration > self.slow_threshold:
+            self.slow_ticks += 1
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Slow %s", profile.describe())
+
+        self._ticks_since_summary += 1
+        if self._ticks_since_summary >= self.summary_every:
+            self._ticks_since_summary = 0
+            self.log_summary()
+
+    def phase_percentiles(self):
+        phases = defaultdict(list)
+        for profile in self.recent:
+            for phase, values in profile.spans.items():
+                phases[phase].extend(values)
+        result = {}
+        for phase, values in phases.items():
+            values.sort()
+            result[phase] = {
+                'n': len(values),
+                'p50': percentile(values, 0.5),
+                'p90': percentile(values, 0.9),
+                'p99': percentile(values, 0.99),
+                'max': values[-1],
+            }
+        return result
+
+    def log_summary(self):
+        if not self.recent:
+            return
+        durations = sorted(p.duration for p in self.recent)
+        slow = [p for p in self.recent if p.duration > self.slow_threshold]
+        text = (f"Last {len(durations)} ticks: p50 {percentile(durations, 0.5):.3f}s, "
+                f"p90 {percentile(durations, 0.9):.3f}s, max {durations[-1]:.3f}s; "
+                f"{len(slow)} slow (> {self.slow_threshold:.1f}s), {self.overruns} overruns in total")
+        if slow:
+            text += f". Slowest: {max(slow, key=lambda p: p.duration).describe()}"
+        (self.logger.warning if slow else self.logger.info)(text)
+
+        if self.debug:
+            for phase, p in sorted(self.phase_percentiles().items()):
+                self.logger.info(f"  {phase:<12} n={p['n']:<5} p50={p['p50']:.4f}s p90={p['p90']:.4f}s "
+                                 f"p99={p['p99']:.4f}s max={p['max']:.4f}s")
+
+
+def make_trace_config() -> aiohttp.TraceConfig:
+    """
+    Records queue/dns/connect/ttfb spans of requests made with trace_request_ctx=TickProfile.request_ctx(side).
+    """
+
+    def target(ctx):
+        req = ctx.trace_request_ctx
+        return req if isinstance(req, SimpleNamespace) and hasattr(req, 'profile') else None
+
+    def start(name):
+        async def hook(_session, ctx, _params):
+            if target(ctx):
+                setattr(ctx, name, time.monotonic())
+        return hook
+
+    def end(name, phase):
+        async def hook(_session, ctx, _params):
+            req = target(ctx)
+            started = getattr(ctx, name, None)
+            if req and started is not None:
+                elapsed = time.monotonic() - started
+                if phase == 'connect':
+                    # connection creation includes name resolution, which is its own phase
+                    elapsed -= getattr(ctx, 'dns_elapsed', 0.0)
+                if phase == 'dns':
+                    ctx.dns_elapsed = elapsed
+                req.profile.add(f'{req.side}.{phase}', elapsed)
+        return hook
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(start('queue_started'))
+    trace_config.on_connection_queued_end.append(end('queue_started', 'queue'))
+    trace_config.on_dns_resolvehost_start.append(start('dns_started'))
+    trace_config.on_dns_resolvehost_end.append(end('dns_started', 'dns'))
+    trace_config.on_connection_create_start.append(start('connect_started'))
+    trace_config.on_connection_create_end.append(end('connect_started', 'connect'))
+    trace_config.on_request_headers_sent.append(start('sent'))
+    trace_config.on_request_end.append(end('sent', 'ttfb'))
+    return trace_config
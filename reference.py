@@ -0,0 +1,180 @@
+import asyncio
+import statistics
+import time
+from collections import Counter, deque
+from typing import List
+
+import metrics
+from job import Timed
+from logs import WithLogger
+from node import Node
+from profiling import percentile
+
+
+def median_by(key):
+    """
+    Upper median: always one of the real answers, so its arrival time stays meaningful.
+    Of two answers the higher one wins: a stuck reference falls behind, it can't get ahead.
+    """
+
+    def pick(answers: List[Timed]) -> Timed:
+        ordered = sorted(answers, key=lambda t: key(t.value))
+        return ordered[len(ordered) // 2]
+
+    return pick
+
+
+def majority_by(key):
+    """
+    The most common value; ties go to the one that arrived first.
+    """
+
+    def pick(answers: List[Timed]) -> Timed:
+        counts = Counter(key(t.value) for t in answers)
+        top = max(counts.values())
+        return min((t for t in answers if counts[key(t.value)] == top), key=lambda t: t.arrived)
+
+    return pick
+
+
+class ReferencePool(WithLogger):
+    """
+    Several reference nodes queried as one. The `quorum` fastest of them are asked first;
+    a request that fails or stays unanswered longer than usual (hedge_percentile of recent latencies)
+    is backed by a request to a spare reference. The result is the consensus of the answers
+    that arrived before the deadline; once there is at least one answer and no spare is left,
+    the others are only waited for until the hedge delay. Stragglers are not cancelled: they finish
+    in the background, so a slow reference still gets its latency recorded and sinks in the ranking.
+    """
+
+    MIN_SAMPLES = 5
+
+    def __init__(self, nodes: List[Node], fetch, consensus, name='', quorum=2, hedge_percentile=0.9,
+                 deadline=5.0, initial_hedge_delay=1.0, min_hedge_delay=0.05, history=50):
+        super().__init__()
+        if not nodes:
+            raise ValueError('No reference nodes configured')
+        self.nodes = nodes
+        self.fetch = fetch
+        self.consensus = consensus
+        self.name = name
+        self.quorum = max(1, min(quorum, len(nodes)))
+        self.hedge_percentile = hedge_percentile
+        self.deadline = deadline
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.latencies = {node.name: deque(maxlen=history) for node in nodes}
+        self.answer_latencies = deque(maxlen=history * len(nodes))
+        self.hedges = 0
+        self.timeouts = 0
+        self._stragglers = set()
+
+    @property
+    def urls(self):
+        return [node.url for node in self.nodes]
+
+    def ranked(self) -> List[Node]:
+        # references never measured go first, so each of them gets probed at least once
+        def score(node):
+            samples = self.latencies[node.name]
+            return statistics.median(samples) if samples else 0.0
+
+        return sorted(self.nodes, key=score)
+
+    def hedge_delay(self) -> float:
+        samples = sorted(self.answer_latencies)
+        if len(samples) < self.MIN_SAMPLES:
+            delay = self.initial_hedge_delay
+        else:
+            delay = percentile(samples, self.hedge_percentile)
+        return min(max(delay, self.min_hedge_delay), self.deadline)
+
+    async def _fetch_one(self, node: Node) -> Timed:
+        started = time.monotonic()
+        try:
+            value = await self.fetch(node.url)
+        except Exception as e:
+            self.logger.warning(f"Reference {node.name} failed: {e!r}")
+            value = None
+        result = Timed(value, started, time.monotonic())
+        if result.ok:
+            self.answer_latencies.append(result.latency)
+        # for the ranking a failure counts as at least as slow as the deadline
+        self.latencies[node.name].append(result.latency if result.ok else max(result.latency, self.deadline))
+        return result
+
+    async def query(self) -> Timed:
+        started = time.monotonic()
+        deadline = started + self.deadline
+        hedge_delay = self.hedge_delay()
+        next_hedge = started + hedge_delay
+
+        order = self.ranked()
+        spare = deque(order[self.quorum:])
+        pending = {}  # task -> node
+        answers = []
+
+        def launch(node):
+            task = asyncio.ensure_future(self._fetch_one(node))
+            pending[task] = node
+
+        for node in order[:self.quorum]:
+            launch(node)
+
+        while len(answers) < self.quorum:
+            now = time.monotonic()
+            needed = self.quorum - len(answers)
+            target = needed
+            if now >= next_hedge:
+                # one spare for every request we are still waiting for
+                target += len(pending)
+                next_hedge = now + hedge_delay
+            while spare and len(pending) < target:
+                node = spare.popleft()
+                self.logger.debug("Hedging with reference %s after %.3f sec", node.name, now - started)
+                self.hedges += 1
+                metrics.REFERENCE_HEDGES.inc(job=self.name)
+                launch(node)
+
+            if not pending or now >= deadline:
+                break
+            if answers and not spare and now - started >= hedge_delay:
+                break
+
+            wake_at = min(deadline, next_hedge)
+            done, _ = await asyncio.wait(pending, timeout=max(0.0, wake_at - now),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del pending[task]
+                result = task.result()
+                if result.ok:
+                    answers.append(result)
+
+        if pending:
+            self.timeouts += len(answers) < self.quorum
+            self._stragglers.update(pending)
+            for task in pending:
+                task.add_done_callback(self._stragglers.discard)
+
+        if not answers:
+            if pending:
+                self.logger.error(f"No reference answered within {self.deadline:.1f} sec")
+            else:
+                self.logger.error(f"All {len(self.nodes)} references failed")
+            return Timed(None, started, time.monotonic())
+
+        chosen = self.consensus(answers)
+        self.logger.debug("Reference consensus of %d/%d answers in %.3f sec (hedge delay %.3f sec)",
+                          len(answers), len(self.nodes), chosen.arrived - started, hedge_delay)
+        return Timed(chosen.value, started, chosen.arrived)
+
+    @property
+    def stats(self):
+        return {
+            'hedges': self.hedges,
+            'timeouts': self.timeouts,
+            'latency': {
+                name: statistics.median(samples) if samples else None
+                for name, samples in self.latencies.items()
+            },
+        }
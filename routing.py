@@ -0,0 +1,117 @@
+import itertools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# severity of an outgoing message
+INFO = 'info'  # progress, keep-alive and service messages
+ALERT = 'alert'  # a problem was found
+RESOLVED = 'resolved'  # the problem is gone
+SEVERITIES = (INFO, ALERT, RESOLVED)
+
+ANY = '*'
+
+RouteKey = Tuple[str, str, str]  # (job, severity, node)
+
+
+class Route:
+    """
+    Sends the messages that match (job, severity, node) to the chats; '*' matches anything.
+    A route without chats mutes what it matches.
+    """
+
+    def __init__(self, chats: Iterable[int], job=ANY, severity=ANY, node=ANY):
+        if severity != ANY and severity not in SEVERITIES:
+            raise ValueError(f'Unknown severity {severity!r}, must be one of {", ".join(SEVERITIES)}')
+        self.chats = tuple(int(chat) for chat in chats)
+        self.job = job or ANY
+        self.severity = severity or ANY
+        self.node = node or ANY
+
+    def __repr__(self):
+        chats = ','.join(map(str, self.chats)) or 'mute'
+        return f'Route({self.job}/{self.severity}/{self.node}={chats})'
+
+    def __eq__(self, other):
+        return isinstance(other, Route) and (self.key, self.chats) == (other.key, other.chats)
+
+    def __hash__(self):
+        return hash((self.key, self.chats))
+
+    @property
+    def key(self) -> RouteKey:
+        return self.job, self.severity, self.node
+
+    @classmethod
+    def parse(cls, item: str) -> 'Route':
+        """
+        "job[/severity[/node]]=chat1,chat2" or "...=mute".
+        """
+        pattern, sep, chats = item.partition('=')
+        if not sep:
+            raise ValueError(f'Bad route {item!r}: expected job[/severity[/node]]=chats')
+        fields = [field.strip() for field in pattern.split('/', 2)]
+        chats = chats.strip()
+        chats = [] if chats.lower() == 'mute' else [c for c in chats.replace(',', ' ').split()]
+        return cls(chats, *fields)
+
+    @classmethod
+    def from_table(cls, table: dict) -> 'Route':
+        unknown = set(table) - {'job', 'severity', 'node', 'chats'}
+        if unknown:
+            raise ValueError(f'Unknown route keys: {", ".join(sorted(unknown))}')
+        chats = table.get('chats', [])
+        if not isinstance(chats, list):
+            chats = [chats]
+        return cls(chats, table.get('job', ANY), table.get('severity', ANY), table.get('node', ANY))
+
+
+def parse_routes(spec: str) -> List[Route]:
+    """
+    Routes separated by semicolons or new lines, see Route.parse.
+    """
+    return [Route.parse(item) for item in spec.replace('\n', ';').split(';') if item.strip()]
+
+
+# which fields of the key are kept (the others become '*'), from the most specific pattern to the catch-all:
+# the job counts more than the node, the node more than the severity
+_MASKS = sorted(itertools.product((True, False), repeat=3),
+                key=lambda mask: -(4 * mask[0] + mask[2] * 2 + mask[1]))
+
+
+class Router:
+    """
+    The most specific matching route decides where a message goes; routes with the same pattern add up.
+    Without a matching route messages go to the default chats.
+    The routes are indexed by their pattern, so a lookup is a few dict hits whatever the number of routes,
+    and its result is remembered.
+    """
+
+    MAX_MEMO = 10_000
+
+    def __init__(self, routes: List[Route], default_chats: Iterable[int] = ()):
+        self.routes = list(routes)
+        self.default_chats = tuple(int(chat) for chat in default_chats)
+
+        self._index: Dict[RouteKey, Tuple[int, ...]] = {(ANY, ANY, ANY): self.default_chats}
+        explicit = set()
+        for route in self.routes:
+            known = self._index.get(route.key, ()) if route.key in explicit else ()
+            self._index[route.key] = tuple(dict.fromkeys(known + route.chats))
+            explicit.add(route.key)
+        self._memo: Dict[RouteKey, Tuple[int, ...]] = {}
+
+    def lookup(self, job: Optional[str], severity: str, node: Optional[str]) -> Tuple[int, ...]:
+        key = (job or '', severity, node or '')
+        chats = self._memo.get(key)
+        if chats is None:
+            if len(self._memo) >= self.MAX_MEMO:
+                self._memo.clear()
+            chats = self._memo[key] = self._match(key)
+        return chats
+
+    def _match(self, key: RouteKey):
+        for mask in _MASKS:
+            pattern = tuple(field if keep else ANY for field, keep in zip(key, mask))
+            chats = self._index.get(pattern)
+            if chats is not None:
+                return chats
+        return self.default_chats
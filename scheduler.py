@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Dict, Optional
+
+from job import AbstractJob
+from logs import WithLogger
+
+
+class ScheduledJob:
+    def __init__(self, job: AbstractJob, period: float):
+        self.job = job
+        self.period = period
+        self.job_period = job.period  # to notice when the job changes it
+        self.generation = 0
+        self.removed = False
+        self.jitter = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.ticks = 0
+        self.first_deadline = None
+        self.last_grid = None
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = 0.0
+
+    def missed_deadlines(self, now: float = None) -> int:
+        """
+        How many deadlines have passed since the last completed tick (or since the first deadline).
+        """
+        now = time.monotonic() if now is None else now
+        reference = self.last_finished or self.first_deadline
+        if reference is None or now <= reference:
+            return 0
+        return int((now - reference) // self.period)
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    @property
+    def stats(self):
+        return {
+            'period': self.period,
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'overruns': self.overruns,
+            'skipped_ticks': self.skipped_ticks,
+            'ticks': self.ticks,
+            'last_duration': self.last_duration,
+            'missed_deadlines': self.missed_deadlines(),
+        }
+
+
+class Scheduler(WithLogger):
+    """
+    Runs all jobs from one timer heap on a fixed grid of deadlines: start + k * period.
+    The tick duration does not shift the next deadline, so there is no drift.
+    Each job gets a random phase at start, so jobs with the same period don't fire together.
+    If a tick is still running when its next deadline comes, that deadline is skipped and counted as an overrun.
+    When a job changes its period, it is moved to the new grid after the tick.
+    """
+
+    def __init__(self, start_jitter: float = 1.0, tick_jitter: float = 0.0, lag_warning: float = 1.0):
+        super().__init__()
+        self.start_jitter = start_jitter  # fraction of the period
+        self.tick_jitter = tick_jitter  # fraction of the period, does not accumulate
+        self.lag_warning = lag_warning  # sec
+        self.entries: Dict[AbstractJob, ScheduledJob] = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def add(self, job: AbstractJob, period: float = None, start_delay: float = None):
+        if job in self.entries:
+            raise ValueError(f'Job {job.name} is already scheduled')
+
+        entry = self.entries[job] = ScheduledJob(job, period or job.period)
+        if start_delay is None:
+            start_delay = random.uniform(0, entry.period * self.start_jitter)
+        entry.first_deadline = time.monotonic() + start_delay
+        self._push(entry, entry.first_deadline)
+        self.logger.info(f"Scheduled {job.name} every {entry.period} sec, first tick in {start_delay:.1f} sec")
+        return entry
+
+    def remove(self, job: AbstractJob):
+        entry = self.entries.pop(job, None)
+        if entry is None:
+            return
+        entry.removed = True
+        if entry.running:
+            entry.task.cancel()
+        self._wakeup.set()
+
+    def reschedule(self, job: AbstractJob, period: float):
+        """
+        Moves the job to another period. The next deadline is one new period after the last one,
+        or right away if that has already passed.
+        """
+        entry = self.entries.get(job)
+        if entry is None or period == entry.period:
+            return
+        self.logger.debug(f"Rescheduled {job.name}: every {entry.period:.1f} → {period:.1f} sec")
+        entry.period = period
+        entry.generation += 1
+        entry.jitter = 0.0
+        if entry.last_grid is None:
+            self._push(entry, entry.first_deadline)
+        else:
+            self._push(entry, max(entry.last_grid + period, time.monotonic()))
+
+    @property
+    def stats(self):
+        return {entry.job.name: entry.stats for entry in self.entries.values()}
+
+    def unhealthy_jobs(self, max_missed_deadlines: int = 3):
+        now = time.monotonic()
+        return [entry.job for entry in self.entries.values()
+                if entry.missed_deadlines(now) >= max_missed_deadlines]
+
+    def _push(self, entry: ScheduledJob, deadline: float):
+        heapq.heappush(self._heap, (deadline, next(self._seq), entry, entry.generation))
+        self._wakeup.set()
+
+    async def run(self):
+        self.logger.info("Scheduler started")
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            deadline, _, entry, generation = self._heap[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if entry.removed or generation != entry.generation:
+                continue
+            self._fire(entry, deadline)
+
+    def _fire(self, entry: ScheduledJob, deadline: float):
+        now = time.monotonic()
+        entry.lag = now - deadline
+        entry.max_lag = max(entry.max_lag, entry.lag)
+        if entry.lag > self.lag_warning:
+            self.logger.warning(f"{entry.job.name} is late by {entry.lag:.2f} sec. Is the event loop overloaded?")
+
+        if entry.running:
+            entry.overruns += 1
+            self.logger.warning(f"{entry.job.name}: previous tick is still running "
+                                f"(overrun #{entry.overruns}), skipping this one")
+        else:
+            entry.task = asyncio.create_task(self._run_job(entry))
+
+        # next point of the grid, ignoring the jitter of this one
+        grid = entry.last_grid = deadline - entry.jitter
+        next_grid = grid + entry.period
+        if next_grid <= now:
+            missed = int((now - next_grid) // entry.period) + 1
+            entry.skipped_ticks += missed
+            next_grid += missed * entry.period
+        entry.jitter = random.uniform(0, entry.period * self.tick_jitter) if self.tick_jitter else 0.0
+        self._push(entry, next_grid + entry.jitter)
+
+    async def _run_job(self, entry: ScheduledJob):
+        entry.last_started = time.monotonic()
+        try:
+            await entry.job.run_tick()
+        finally:
+            entry.last_finished = time.monotonic()
+            entry.last_duration = entry.last_finished - entry.last_started
+            entry.ticks += 1
+            # the job may have changed its own period (adaptive polling)
+            if entry.job.period != entry.job_period and not entry.removed:
+                entry.job_period = entry.job.period
+                self.reschedule(entry.job, entry.job.period)
@@ -0,0 +1,106 @@
+from array import array
+from typing import Optional, Tuple
+
+
+class TimeSeries:
+    """
+    Fixed-size ring buffer of (timestamp, value) samples stored in two flat float arrays, no per-sample objects.
+    If samples come more often than min_interval, the newest one replaces the last stored sample,
+    so the series covers about capacity * min_interval seconds and always ends with the newest value.
+    """
+
+    def __init__(self, capacity: int = 720, min_interval: float = 0.0):
+        assert capacity >= 2
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self._ts = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _index(self, i):
+        # i-th sample from the oldest one
+        return (self._start + i) % self.capacity
+
+    def clear(self):
+        self._start = self._size = 0
+
+    def append(self, ts: float, value: float):
+        if self._size >= 2:
+            # the last sample stays "open" until it is min_interval away from the one before it
+            prev = self._index(self._size - 2)
+            if ts - self._ts[prev] < self.min_interval:
+                last = self._index(self._size - 1)
+                self._ts[last], self._values[last] = ts, value
+                return
+
+        if self._size < self.capacity:
+            i = self._index(self._size)
+            self._size += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._ts[i], self._values[i] = ts, value
+
+    def to_list(self):
+        return [[t, v] for t, v in self.samples()]
+
+    def load(self, samples):
+        self.clear()
+        for t, v in samples[-self.capacity:]:
+            self.append(float(t), float(v))
+
+    def last(self) -> Optional[Tuple[float, float]]:
+        if not self._size:
+            return None
+        i = self._index(self._size - 1)
+        return self._ts[i], self._values[i]
+
+    def first(self) -> Optional[Tuple[float, float]]:
+        if not self._size:
+            return None
+        return self._ts[self._start], self._values[self._start]
+
+    def samples(self, window: float = None):
+        """
+        Yields (ts, value) from the oldest to the newest; only the last `window` seconds if it is given.
+        """
+        if not self._size:
+            return
+        since = self.last()[0] - window if window is not None else float('-inf')
+        for k in range(self._size):
+            i = self._index(k)
+            if self._ts[i] >= since:
+                yield self._ts[i], self._values[i]
+
+    def span(self, window: float = None) -> float:
+        ts = [t for t, _ in self.samples(window)]
+        return ts[-1] - ts[0] if ts else 0.0
+
+    def slope(self, window: float = None, min_span: float = 0.0) -> Optional[float]:
+        """
+        Least squares rate of change (value units per second) over the last `window` seconds.
+        None if there are less than 2 samples or they cover less than min_span seconds.
+        """
+        n = sx = sy = sxx = sxy = 0.0
+        t0 = first_t = last_t = None
+        for t, v in self.samples(window):
+            if t0 is None:
+                t0 = first_t = t
+            last_t = t
+            x = t - t0  # keeps the sums small
+            n += 1
+            sx += x
+            sy += v
+            sxx += x * x
+            sxy += x * v
+
+        if n < 2 or last_t - first_t < max(min_span, 1e-9):
+            return None
+        denominator = n * sxx - sx * sx
+        if denominator <= 0:
+            return None
+        return (n * sxy - sx * sy) / denominator
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import tempfile
+from typing import Callable, Dict, Optional
+
+from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+
+from logs import WithLogger
+from utils import now_ts, DAY
+
+
+class StateStore(WithLogger):
+    """
+    Persistent key-value state of jobs, backed by TinyDB.
+    Owners register a getter (and a setter to restore from) under a key; nothing is written on a tick.
+    Every flush_interval seconds the getters are polled on the event loop thread, and if anything changed,
+    the whole snapshot is written to disk in a worker thread (write-behind).
+    Keys that no registered owner refreshed for max_age (e.g. of removed jobs) are dropped on flush,
+    and the file is rewritten from scratch every time, so it only ever holds the live state.
+    A snapshot goes to a temporary file that replaces the old one, so a crash never leaves a half-written file;
+    a file that can't be read anyway is moved aside and the bot starts with empty state.
+    """
+
+    TABLE = 'state'
+
+    def __init__(self, path: str, flush_interval: float = 10.0, max_age: float = 30 * DAY):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        self._data: Dict[str, dict] = {}  # key -> {'value': ..., 'ts': ...}
+        self._providers: Dict[str, Callable] = {}
+        self._dirty = False
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self.writes = 0
+
+    def load(self):
+        self._loaded = True
+        if not os.path.exists(self.path):
+            self.logger.info(f"No state in {self.path!r} yet")
+            return self
+        try:
+            with TinyDB(self.path, storage=CachingMiddleware(JSONStorage)) as db:
+                docs = db.table(self.TABLE).all()
+            data = {doc['key']: {'value': doc.get('value'), 'ts': doc.get('ts', 0)} for doc in docs}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            aside = f'{self.path}.corrupt-{int(now_ts())}'
+            self.logger.error(f"Failed to load state from {self.path!r}: {e!r}; moved to {aside!r}, starting afresh")
+            try:
+                os.replace(self.path, aside)
+            except OSError as e:
+                self.logger.error(f"Failed to move {self.path!r} aside: {e!r}")
+            return self
+        self._data.update(data)
+        self.logger.info(f"Loaded {len(self._data)} state entries from {self.path!r}")
+        return self
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        return entry['value'] if entry is not None else default
+
+    def set(self, key, value):
+        entry = self._data.get(key)
+        if entry is None or entry['value'] != value:
+            self._dirty = True
+        self._data[key] = {'value': value, 'ts': now_ts()}
+
+    def delete(self, key):
+        if self._data.pop(key, None) is not None:
+            self._dirty = True
+
+    def register(self, key, getter: Callable, setter: Optional[Callable] = None):
+        """
+        getter() must return fresh JSON-serializable data (not an object the owner keeps mutating), or None to skip;
+        setter(data) is called at once if there is saved state.
+        """
+        self._providers[key] = getter
+        if setter:
+            self.restore(key, setter)
+
+    def restore(self, key, setter: Callable):
+        """
+        Calls setter(data) if there is saved state under the key, without registering anything.
+        """
+        saved = self.get(key)
+        if saved is not None:
+            try:
+                setter(saved)
+                self.logger.info(f"Restored state of {key!r}")
+            except Exception as e:
+                self.logger.exception(f"Failed to restore state of {key!r}: {e!r}")
+
+    def unregister(self, key):
+        self._providers.pop(key, None)
+
+    def _collect(self):
+        for key, getter in self._providers.items():
+            try:
+                value = getter()
+                if value is not None:
+                    self.set(key, value)
+            except Exception as e:
+                self.logger.exception(f"Failed to get state of {key!r}: {e!r}")
+
+    def _compact(self):
+        threshold = now_ts() - self.max_age
+        stale = [key for key, entry in self._data.items()
+                 if entry['ts'] < threshold and key not in self._providers]
+        for key in stale:
+            del self._data[key]
+        if stale:
+            self._dirty = True
+            self.logger.info(f"Dropped {len(stale)} stale state entries")
+
+    def _write(self, docs):
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+        os.close(fd)
+        try:
+            with TinyDB(tmp_path, storage=CachingMiddleware(JSONStorage)) as db:
+                db.table(self.TABLE).insert_multiple(docs)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    async def flush(self):
+        if not self._loaded:
+            return
+        async with self._lock:
+            self._collect()
+            self._compact()
+            if not self._dirty:
+                return
+            docs = [{'key': key, **entry} for key, entry in self._data.items()]
+            self._dirty = False
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, docs)
+                self.writes += 1
+            except Exception as e:
+                self._dirty = True
+                self.logger.exception(f"Failed to save state: {e!r}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
+        self._loaded = False
@@ -0,0 +1,71 @@
+from typing import List
+
+# state of a job after its last tick, from the best to the worst
+OK = 'ok'
+ALERT = 'alert'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+
+# exit codes of the one-shot check (main.py --once)
+EXIT_CODES = {
+    OK: 0,
+    ALERT: 1,
+    ERROR: 2,
+    TIMEOUT: 2,
+}
+
+
+def exit_code(statuses: List[dict]) -> int:
+    return max((EXIT_CODES.get(status.get('state'), 2) for status in statuses), default=0)
+
+
+def describe(status: dict, limit=3) -> str:
+    """
+    Nodes with problems first (at most `limit` of them), the healthy ones are only counted
+    unless there are just a few; the alerts if the job didn't report its nodes.
+    """
+    nodes = status.get('nodes', {})
+    bad = [(name, node['text']) for name, node in nodes.items() if not node['ok']]
+    good = [(name, node['text']) for name, node in nodes.items() if node['ok']]
+
+    def show(name, text):
+        return f'{name}: {text}' if name else text
+
+    parts = [show(name, text) for name, text in bad[:limit]]
+    if len(bad) > limit:
+        parts.append(f'and {len(bad) - limit} more')
+    if bad and good:
+        parts.append(f'{len(good)} ok')
+    elif len(good) <= limit:
+        parts.extend(show(name, text) for name, text in good)
+    else:
+        parts.append(f'all {len(good)} ok')
+
+    if status.get('error'):
+        parts.append(status['error'])
+    if not parts and status.get('alerts'):
+        parts.append(', '.join(status['alerts']))
+    return '; '.join(parts)
+
+
+def format_table(statuses: List[dict], width=100) -> str:
+    rows = [('JOB', 'STATE', 'TIME', 'DETAILS')]
+    for status in statuses:
+        duration = status.get('duration')
+        rows.append((
+            status.get('job', '?'),
+            status.get('state', '?').upper(),
+            f'{duration:.2f}s' if duration is not None else '-',
+            describe(status),
+        ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    lines = []
+    for row in rows:
+        head = '  '.join(cell.ljust(w) for cell, w in zip(row, widths))
+        details = row[3]
+        room = max(20, width - len(head) - 2)
+        if len(details) > room:
+            details = details[:room - 1] + '…'
+        lines.append(f'{head}  {details}'.rstrip())
+    return '\n'.join(lines)
@@ -0,0 +1,147 @@
+from typing import Dict, Optional, Tuple
+
+from cooldown import Cooldown
+from logs import WithLogger
+from routing import ALERT, RESOLVED
+from utils import now_ts, format_timedelta, HOUR, MINUTE
+
+AlertKey = Tuple[str, str, str]  # (job, node, condition)
+
+
+class ActiveAlert:
+    def __init__(self, key: AlertKey, text: str, cooldown: Cooldown):
+        self.key = key
+        self.text = text
+        self.cd = cooldown
+        self.since = now_ts()
+        self.sent = 0
+        self.suppressed = 0
+        self.suppressed_total = 0
+        self.cleared_at = None  # when the condition cleared; the alert is still kept until it stays clear
+        self.resolve_text = None
+
+
+class AlertSuppressor(WithLogger):
+    """
+    Keeps track of active alert conditions, keyed by (job, node, condition).
+    The first alert goes out at once; repeats of the same key are suppressed with an exponentially growing cooldown.
+    When the condition clears, a single "resolved" message is sent, but only once it has stayed clear
+    for a whole cooldown: a condition that flaps comes back to the same alert and its backoff goes on.
+    """
+
+    def __init__(self, alert, cooldown: float = MINUTE, max_cooldown: float = 6 * HOUR, grow_factor: float = 2.0):
+        super().__init__()
+        self.alert = alert
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.grow_factor = grow_factor
+        self.active: Dict[AlertKey, ActiveAlert] = {}
+        self.suppressed_total = 0
+
+    @staticmethod
+    def make_key(job: str, node: Optional[str], condition: str) -> AlertKey:
+        return job, node or '', condition
+
+    async def fire(self, key: AlertKey, text: str) -> bool:
+        entry = self.active.get(key)
+        if entry is None:
+            cd = Cooldown(key, self.cooldown, self.max_cooldown, self.grow_factor)
+            entry = self.active[key] = ActiveAlert(key, text, cd)
+        elif entry.cleared_at is not None:
+            self.logger.debug(f"{key} is back after {now_ts() - entry.cleared_at:.0f} sec")
+            entry.cleared_at = None
+
+        if not entry.cd.ready:
+            entry.suppressed += 1
+            entry.suppressed_total += 1
+            self.suppressed_total += 1
+            self.logger.debug(f"Suppressed {key}: {entry.suppressed} repeats, next in {entry.cd.duration:.0f} sec")
+            return False
+
+        if entry.suppressed:
+            text = f"{text}\n<i>({entry.suppressed} repeats suppressed)</i>"
+        if entry.sent:
+            entry.cd.grow_duration()
+        entry.cd.do()
+        entry.sent += 1
+        entry.suppressed = 0
+        job, node, _ = key
+        await self.alert.send(text, job=job, node=node, severity=ALERT)
+        return True
+
+    async def resolve(self, key: AlertKey, text: str = None) -> bool:
+        entry = self.active.get(key)
+        if entry is None:
+            return False
+
+        now = now_ts()
+        if entry.cleared_at is None:
+            entry.cleared_at = now
+        entry.resolve_text = text or entry.resolve_text
+        if now - entry.cleared_at < entry.cd.duration:
+            return False
+
+        # the grown cooldown goes with the entry: the next outage starts from the base cooldown again
+        del self.active[key]
+        text = entry.resolve_text or f"✅ Resolved: {entry.text.lstrip('🚨 ')}"
+        text += (f"\n<i>(lasted {format_timedelta(entry.cleared_at - entry.since)}, "
+                 f"{entry.sent} alerts sent, {entry.suppressed_total} repeats suppressed)</i>")
+        job, node, _ = key
+        await self.alert.send(text, job=job, node=node, severity=RESOLVED)
+        return True
+
+    def get_state(self):
+        return {
+            '|'.join(key): {
+                'text': entry.text,
+                'since': entry.since,
+                'sent': entry.sent,
+                'suppressed': entry.suppressed,
+                'suppressed_total': entry.suppressed_total,
+                'cleared_at': entry.cleared_at,
+                'resolve_text': entry.resolve_text,
+                'cooldown': entry.cd.to_dict(),
+            }
+            for key, entry in self.active.items()
+        }
+
+    def set_state(self, state: dict):
+        for key_str, d in state.items():
+            key = tuple(key_str.split('|', 2))
+            if len(key) != 3:
+                continue
+            entry = ActiveAlert(key, d.get('text', ''), Cooldown(key, self.cooldown, self.max_cooldown,
+                                                                 self.grow_factor))
+            entry.since = d.get('since', entry.since)
+            entry.sent = d.get('sent', 0)
+            entry.suppressed = d.get('suppressed', 0)
+            entry.suppressed_total = d.get('suppressed_total', 0)
+            entry.cleared_at = d.get('cleared_at')
+            entry.resolve_text = d.get('resolve_text')
+            entry.cd.load(d.get('cooldown', {}))
+            self.active[key] = entry
+
+    def forget(self, key: AlertKey):
+        self.active.pop(key, None)
+
+    def forget_job(self, job: str, keep_nodes=None) -> int:
+        """
+        Drops the alerts of a removed job without "resolved" messages; keep_nodes: node names whose alerts stay
+        ('' for the job-wide ones). Returns how many were dropped.
+        """
+        keys = [key for key in self.active
+                if key[0] == job and (keep_nodes is None or key[1] not in keep_nodes)]
+        for key in keys:
+            del self.active[key]
+        return len(keys)
+
+    def is_active(self, key: AlertKey):
+        entry = self.active.get(key)
+        return entry is not None and entry.cleared_at is None
+
+    @property
+    def stats(self):
+        return {
+            'active': len(self.active),
+            'suppressed_total': self.suppressed_total,
+        }
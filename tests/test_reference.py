@@ -0,0 +1,38 @@
+import asyncio
+import unittest
+
+from node import Node
+from reference import ReferencePool, median_by
+
+
+def make_pool(heights, delays, **kwargs):
+    nodes = [Node(f'ref{i}', f'http://ref{i}') for i in range(len(heights))]
+    by_url = {node.url: (height, delay) for node, height, delay in zip(nodes, heights, delays)}
+
+    async def fetch(url):
+        height, delay = by_url[url]
+        await asyncio.sleep(delay)
+        return height
+
+    return ReferencePool(nodes, fetch, median_by(int), name='test', deadline=1.0, initial_hedge_delay=0.5, **kwargs)
+
+
+class TestReferencePool(unittest.IsolatedAsyncioTestCase):
+    async def test_stuck_fast_reference_is_outvoted(self):
+        # the fastest reference is stuck 100 blocks behind
+        pool = make_pool([1000, 1100, 1100], [0.0, 0.05, 0.06], quorum=3)
+        result = await pool.query()
+        self.assertEqual(result.value, 1100)
+
+    def test_default_quorum_keeps_a_spare(self):
+        self.assertEqual(make_pool([1100] * 3, [0.0] * 3).quorum, 2)
+        self.assertEqual(make_pool([1100], [0.0]).quorum, 1)
+
+    async def test_stuck_reference_loses_with_quorum_of_two(self):
+        pool = make_pool([1000, 1100, 1100], [0.0, 0.05, 0.06])
+        result = await pool.query()
+        self.assertEqual(result.value, 1100)
+
+
+if __name__ == '__main__':
+    unittest.main()
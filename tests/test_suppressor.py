@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+from suppressor import AlertSuppressor
+
+
+class FakeSender:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, text, job=None, node=None, severity=None):
+        self.sent.append((severity, text))
+
+
+class TestAlertSuppressor(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 1_000_000.0
+        for target in ('suppressor.now_ts', 'cooldown.now_ts'):
+            patcher = mock.patch(target, lambda: self.now)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sender = FakeSender()
+        self.suppressor = AlertSuppressor(self.sender, cooldown=60, max_cooldown=3600)
+        self.key = self.suppressor.make_key('job', 'node1', 'lag')
+
+    async def test_flapping_condition_is_one_outage(self):
+        # diff 10, 9, 10, 9... every 10 sec for 200 sec
+        for _ in range(10):
+            await self.suppressor.fire(self.key, '🚨 lag')
+            self.now += 10
+            await self.suppressor.resolve(self.key)
+            self.now += 10
+
+        severities = [severity for severity, _ in self.sender.sent]
+        self.assertNotIn('resolved', severities)
+        self.assertLessEqual(len(self.sender.sent), 3)
+        self.assertFalse(self.suppressor.is_active(self.key))
+
+        # clear for a whole (grown) cooldown: one "resolved"
+        for _ in range(30):
+            self.now += 10
+            await self.suppressor.resolve(self.key)
+        resolved = [text for severity, text in self.sender.sent if severity == 'resolved']
+        self.assertEqual(len(resolved), 1)
+        self.assertNotIn(self.key, self.suppressor.active)
+
+    async def test_suppressed_count_in_next_alert(self):
+        await self.suppressor.fire(self.key, '🚨 lag')
+        for _ in range(3):
+            self.now += 10
+            self.assertFalse(await self.suppressor.fire(self.key, '🚨 lag'))
+        self.now += 40
+        self.assertTrue(await self.suppressor.fire(self.key, '🚨 lag'))
+        self.assertEqual(self.sender.sent[-1][1], '🚨 lag\n<i>(3 repeats suppressed)</i>')
+
+        self.now += 10
+        self.assertFalse(await self.suppressor.fire(self.key, '🚨 lag'))
+        self.now += 60
+        self.assertFalse(await self.suppressor.fire(self.key, '🚨 lag'))  # the cooldown has doubled
+
+    async def test_resolved_text_counts(self):
+        await self.suppressor.fire(self.key, '🚨 lag')
+        self.now += 10
+        await self.suppressor.fire(self.key, '🚨 lag')
+        self.now += 50
+        await self.suppressor.resolve(self.key)
+        self.now += 61
+        self.assertTrue(await self.suppressor.resolve(self.key))
+        self.assertEqual(self.sender.sent[-1][1],
+                         '✅ Resolved: lag\n<i>(lasted 0:01:00, 1 alerts sent, 1 repeats suppressed)</i>')
+
+    async def test_forget_job_keeps_configured_nodes(self):
+        for job, node in (('job', 'node1'), ('job', 'node2'), ('job', None), ('other', 'node1')):
+            await self.suppressor.fire(self.suppressor.make_key(job, node, 'lag'), '🚨 lag')
+        self.assertEqual(self.suppressor.forget_job('job', {'', 'node1'}), 1)
+        self.assertEqual(self.suppressor.forget_job('job'), 2)
+        self.assertEqual(list(self.suppressor.active), [('other', 'node1', 'lag')])
+
+
+if __name__ == '__main__':
+    unittest.main()
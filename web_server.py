@@ -0,0 +1,75 @@
+from aiohttp import web
+
+import metrics
+from alerts import AlertSender
+from cache import ResponseCache
+from logs import WithLogger
+from scheduler import Scheduler
+
+
+class StatusServer(WithLogger):
+    """
+    Embedded HTTP server: /metrics in Prometheus text format and /healthz for liveness probes.
+    /healthz fails when any job has missed max_missed_deadlines deadlines in a row, i.e. the bot is wedged.
+    """
+
+    def __init__(self, scheduler: Scheduler, alert: AlertSender, cache: ResponseCache = None,
+                 host='0.0.0.0', port=8000, max_missed_deadlines=3):
+        super().__init__()
+        self.scheduler = scheduler
+        self.alert = alert
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.max_missed_deadlines = max_missed_deadlines
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/metrics', self.handle_metrics)
+        self.app.router.add_get('/healthz', self.handle_healthz)
+        metrics.REGISTRY.add_collector(self.collect)
+
+    def collect(self):
+        now_unhealthy = set(self.scheduler.unhealthy_jobs(self.max_missed_deadlines))
+        for entry in self.scheduler.entries.values():
+            name = entry.job.name
+            metrics.SCHEDULER_LAG.set(entry.lag, job=name)
+            metrics.JOB_PERIOD.set(entry.period, job=name)
+            metrics.SCHEDULER_OVERRUNS.set_total(entry.overruns, job=name)
+            metrics.JOB_HEALTHY.set(0 if entry.job in now_unhealthy else 1, job=name)
+
+        for chat_id, chat in self.alert.chats.items():
+            metrics.ALERT_QUEUE_DEPTH.set(chat.queue.qsize(), chat=chat_id)
+        metrics.ALERTS.set_total(self.alert.queued, outcome='queued')
+        metrics.ALERTS.set_total(self.alert.sent, outcome='sent')
+        metrics.ALERTS.set_total(self.alert.dropped, outcome='dropped')
+        metrics.ALERTS.set_total(self.alert.failed, outcome='failed')
+        metrics.ALERTS.set_total(self.alert.muted, outcome='muted')
+        metrics.ALERTS.set_total(self.alert.suppressor.suppressed_total, outcome='suppressed')
+
+        if self.cache is not None:
+            metrics.CACHE_REQUESTS.set_total(self.cache.hits, result='hit')
+            metrics.CACHE_REQUESTS.set_total(self.cache.misses, result='miss')
+            metrics.CACHE_REQUESTS.set_total(self.cache.merged, result='merged')
+
+    async def handle_metrics(self, _request):
+        return web.Response(body=metrics.REGISTRY.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handle_healthz(self, _request):
+        unhealthy = self.scheduler.unhealthy_jobs(self.max_missed_deadlines)
+        if unhealthy:
+            names = ', '.join(job.name for job in unhealthy)
+            return web.Response(status=503, text=f'missed deadlines: {names}\n')
+        return web.Response(text='ok\n')
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.logger.info(f"Serving /metrics and /healthz on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None